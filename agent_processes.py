@@ -1,31 +1,69 @@
 from multiprocessing import Process
+import signal
+import time
 
-def run_ingestion_agent(ing_in, ing_out):
-    from ingestion_agent import IngestionAgent
-    agent = IngestionAgent(ing_in, ing_out)
+def _reset_signals():
+    # Agents restarted by the supervisor are forked after MCPBroker installed its SIGINT/SIGTERM
+    # handlers; without this, terminating one would run the broker's stop() inside the agent.
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+def _progress_stamp(busy):
+    """Callback that marks progress on the current message, for agents that work through long ones in steps."""
+    def stamp():
+        if busy is not None:
+            busy.value = time.time()
+    return stamp
+
+def _serve(agent, next_message, out_q, sender, busy, index_seq=None):
+    """
+    The agent's message loop. `busy` (a shared multiprocessing.Value) holds when the current message
+    started or last reported progress, and 0 while idle, so the broker can spot an agent stuck on
+    one message even while other threads of the process (or GIL-releasing calls) keep running.
+    `index_seq` likewise holds the broker's sequence number of the index update being handled, so
+    after a crash the broker knows which update was in flight.
+    """
     while True:
-        msg = ing_in.get()
+        msg = next_message()
+        if busy is not None:
+            busy.value = time.time()
+        if index_seq is not None:
+            index_seq.value = (msg.get('index_seq') or (None, 0))[1]
         try:
             agent.run_once(msg)
         except Exception as e:
-            ing_out.put({'type':'ERROR','sender':'IngestionAgent','payload':{'error':str(e)}})
+            out_q.put({'type':'ERROR','sender':sender,'trace_id':msg.get('trace_id'),'payload':{'error':str(e)}})
+        finally:
+            if busy is not None:
+                busy.value = 0.0
+            if index_seq is not None:
+                index_seq.value = 0
 
-def run_retrieval_agent(ret_in, ret_out, K_RETRIEVE, K_RERANK, embedding_model):
+def run_ingestion_agent(ing_in, ing_out, busy=None):
+    _reset_signals()
+    from ingestion_agent import IngestionAgent
+    agent = IngestionAgent(ing_in, ing_out)
+    agent.progress = _progress_stamp(busy)
+    ing_out.put({'type':'AGENT_READY','sender':'IngestionAgent','payload':{}})
+    _serve(agent, agent.next_message, ing_out, 'IngestionAgent', busy)
+
+def run_retrieval_agent(ret_in, ret_out, K_RETRIEVE, K_RERANK, embedding_model, embedding_backend='torch',
+                        retrieval_mode='dense', adaptive=False, dedup_threshold=None, index_dir=None,
+                        snapshot_interval_s=300, busy=None, index_seq=None):
+    _reset_signals()
     from retrieval_agent import RetrievalAgent
-    agent = RetrievalAgent(ret_in, ret_out, K_RETRIEVE=K_RETRIEVE, K_RERANK=K_RERANK, embedding_model=embedding_model)
-    while True:
-        msg = ret_in.get()
-        try:
-            agent.run_once(msg)
-        except Exception as e:
-            ret_out.put({'type':'ERROR','sender':'RetrievalAgent','payload':{'error':str(e)}})
+    agent = RetrievalAgent(ret_in, ret_out, K_RETRIEVE=K_RETRIEVE, K_RERANK=K_RERANK,
+                           embedding_model=embedding_model, embedding_backend=embedding_backend,
+                           retrieval_mode=retrieval_mode, adaptive=adaptive, dedup_threshold=dedup_threshold,
+                           index_dir=index_dir, snapshot_interval_s=snapshot_interval_s)
+    agent.progress = _progress_stamp(busy)
+    # index_seq tells the broker which index updates the loaded snapshot already covers.
+    ret_out.put({'type':'AGENT_READY','sender':'RetrievalAgent','payload':{'index_seq':agent.index_seq}})
+    _serve(agent, ret_in.get, ret_out, 'RetrievalAgent', busy, index_seq)
 
-def run_llm_agent(llm_in, llm_out, model_name="llama3.2:1b"):
+def run_llm_agent(llm_in, llm_out, model_name="llama3.2:1b", busy=None):
+    _reset_signals()
     from llm_response_agent import LLMResponseAgent
     agent = LLMResponseAgent(llm_in, llm_out, model_name=model_name)
-    while True:
-        msg = llm_in.get()
-        try:
-            agent.run_once(msg)
-        except Exception as e:
-            llm_out.put({'type':'ERROR','sender':'LLMResponseAgent','payload':{'error':str(e)}})
+    llm_out.put({'type':'AGENT_READY','sender':'LLMResponseAgent','payload':{}})
+    _serve(agent, llm_in.get, llm_out, 'LLMResponseAgent', busy)
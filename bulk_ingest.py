@@ -0,0 +1,229 @@
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from mcp_agent import MCPBroker
+
+SUPPORTED_EXTS = ("pdf", "pptx", "docx", "csv", "tsv", "xlsx", "txt", "md")
+_DONE = object()
+
+def _log(msg):
+    print(f"[{datetime.now().isoformat()}] [BulkIngest] {msg}", flush=True)
+
+def file_sha256(path: str) -> str:
+    """Hash a file through a read-only memory map, without copying it into Python bytes."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return h.hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            h.update(mm)
+    return h.hexdigest()
+
+def iter_files(root: str):
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+        for name in sorted(filenames):
+            if name.split(".")[-1].lower() in SUPPORTED_EXTS:
+                yield os.path.join(dirpath, name)
+
+
+class Checkpoint:
+    """
+    JSON map of relative path -> {mtime, size, sha256, doc_id} for files whose chunks are in a
+    saved snapshot; doc_id identifies those chunks so they can be removed when the file changes.
+    Files that failed to parse are kept with an 'error' instead of a doc_id, so they are skipped
+    until their content changes.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    def is_unchanged(self, rel: str, st) -> bool:
+        e = self.entries.get(rel)
+        return e is not None and e['size'] == st.st_size and e['mtime'] == st.st_mtime
+
+    def save(self):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp, self.path)
+
+
+class BulkIngester:
+    """
+    Walk a directory tree and feed new or changed files to MCPBroker in batches. A scanner thread
+    stats and hashes files into a bounded queue; the main thread uploads batches, snapshots the
+    index every `snapshot_every` batches and only then checkpoints those files, so an interrupted
+    run resumes from the last snapshot and unchanged files are skipped on later runs. Chunks of
+    changed files are removed before the new version is ingested, and chunks of files that were
+    deleted from the tree are removed at the end of a complete scan. A file that fails to parse
+    is counted and checkpointed as failed rather than aborting the run.
+    """
+
+    def __init__(self, broker: MCPBroker, root: str, checkpoint: Checkpoint,
+                 batch_files=16, queue_size=64, snapshot_every=8, timeout=None):
+        self.broker = broker
+        self.root = root
+        self.checkpoint = checkpoint
+        self.batch_files = batch_files
+        self.snapshot_every = snapshot_every
+        self.timeout = timeout
+        self.work_q = queue.Queue(maxsize=queue_size)
+        # 'chunks' counts parsed chunks as uploads return; 'indexed' only those a snapshot has
+        # confirmed, since upload_files returns before text documents are embedded.
+        self.stats = {'scanned': 0, 'unchanged': 0, 'files': 0, 'chunks': 0, 'indexed': 0, 'bytes': 0, 'removed': 0,
+                      'failed': 0}
+        self._unindexed_chunks = 0
+        self._start = None
+        self._seen = set()
+        self._scan_complete = False
+
+    def _scan(self):
+        try:
+            for path in iter_files(self.root):
+                rel = os.path.relpath(path, self.root)
+                st = os.stat(path)
+                self._seen.add(rel)
+                self.stats['scanned'] += 1
+                if self.checkpoint.is_unchanged(rel, st):
+                    self.stats['unchanged'] += 1
+                    continue
+                digest = file_sha256(path)
+                prev = self.checkpoint.entries.get(rel)
+                if prev is not None and prev['sha256'] == digest:
+                    # Touched but identical content: refresh mtime, don't reindex.
+                    prev.update(mtime=st.st_mtime, size=st.st_size)
+                    self.stats['unchanged'] += 1
+                    continue
+                self.work_q.put((path, rel, {'mtime': st.st_mtime, 'size': st.st_size, 'sha256': digest}))
+            self._scan_complete = True
+        finally:
+            self.work_q.put(_DONE)
+
+    def _commit(self, pending):
+        if self.broker.lost_index_updates > self._lost_at_start:
+            # A RetrievalAgent restart came back from the last snapshot without some of the updates
+            # sent since; snapshotting now would persist an index missing chunks of `pending` files.
+            raise RuntimeError(f"RetrievalAgent restarted and lost {self.broker.lost_index_updates - self._lost_at_start} "
+                               f"index updates (raise replay_limit or lower --snapshot-every); not checkpointing "
+                               f"{len(pending)} files, rerun to resume from the last snapshot")
+        # SNAPSHOT_INDEX is queued behind every CHUNKS_ADD sent so far, so its completion is the
+        # point where those chunks are embedded and indexed.
+        self.broker.snapshot_index(timeout=self.timeout)
+        self.stats['indexed'] += self._unindexed_chunks
+        self._unindexed_chunks = 0
+        self.checkpoint.entries.update(pending)
+        self.checkpoint.save()
+        pending.clear()
+        elapsed = max(time.time() - self._start, 1e-9)
+        _log(f"Snapshot: {self.stats['indexed']} chunks indexed ({self.stats['indexed'] / elapsed:.1f} chunks/s indexed)")
+
+    def run(self):
+        scanner = threading.Thread(target=self._scan, daemon=True)
+        scanner.start()
+        start = self._start = time.time()
+        self._lost_at_start = self.broker.lost_index_updates
+        pending, batch, n_batches, done = {}, [], 0, False
+        parse_s = 1e-9
+        while not done:
+            item = self.work_q.get()
+            if item is _DONE:
+                done = True
+            else:
+                batch.append(item)
+            if batch and (done or len(batch) >= self.batch_files):
+                # Changed files: drop the previous version's chunks first (applied before the new chunks).
+                stale = [self.checkpoint.entries[rel].get('doc_id') for _, rel, _ in batch
+                         if rel in self.checkpoint.entries]
+                self.broker.remove_docs([d for d in stale if d])
+                resp = self.broker.upload_files([(rel, path) for path, rel, _ in batch], timeout=self.timeout)
+                results = resp.get('payload', {}).get('results', [])
+                doc_ids = {r.get('doc_name'): r.get('doc_id') for r in results}
+                errors = {r.get('doc_name'): r['error'] for r in results if r.get('error')}
+                for rel, err in errors.items():
+                    _log(f"Failed to ingest {rel}: {err}")
+                self.stats['failed'] += len(errors)
+                self.stats['files'] += len(batch)
+                n_chunks = sum(r.get('num_chunks', 0) for r in results)
+                self.stats['chunks'] += n_chunks
+                self._unindexed_chunks += n_chunks
+                self.stats['bytes'] += sum(e['size'] for _, _, e in batch)
+                pending.update((rel, dict(e, error=errors[rel]) if rel in errors else dict(e, doc_id=doc_ids.get(rel)))
+                               for _, rel, e in batch)
+                batch = []
+                n_batches += 1
+                elapsed = max(time.time() - start, 1e-9)
+                parse_s = elapsed
+                _log(f"{self.stats['files']} files / {self.stats['chunks']} chunks parsed "
+                     f"({self.stats['files'] / elapsed:.2f} files/s, {self.stats['chunks'] / elapsed:.1f} chunks/s parsed, "
+                     f"{self.stats['bytes'] / elapsed / 1e6:.2f} MB/s); {self.stats['unchanged']} unchanged skipped, "
+                     f"{self.stats['failed']} failed")
+                if n_batches % self.snapshot_every == 0:
+                    self._commit(pending)
+        scanner.join()
+        # Only trust "not seen" after a full walk; a scan that failed part-way saw too little.
+        gone = [rel for rel in self.checkpoint.entries if rel not in self._seen] if self._scan_complete else []
+        if gone:
+            self.broker.remove_docs([self.checkpoint.entries[rel].get('doc_id') for rel in gone
+                                     if self.checkpoint.entries[rel].get('doc_id')])
+            for rel in gone:
+                del self.checkpoint.entries[rel]
+            self.stats['removed'] = len(gone)
+            _log(f"Removed chunks of {len(gone)} files no longer under {self.root}")
+        if pending or gone:
+            self._commit(pending)
+        else:
+            self.checkpoint.save()
+        elapsed = max(time.time() - start, 1e-9)
+        self.stats['seconds'] = elapsed
+        still_failing = sum('error' in e for e in self.checkpoint.entries.values())
+        _log(f"Done: scanned {self.stats['scanned']} files, ingested {self.stats['files']} "
+             f"({self.stats['chunks']} chunks), skipped {self.stats['unchanged']} unchanged, "
+             f"removed {self.stats['removed']} deleted, {self.stats['failed']} failed "
+             f"({still_failing} in the checkpoint skipped until changed) in {elapsed:.1f}s "
+             f"-> {self.stats['files'] / elapsed:.2f} files/s, {self.stats['chunks'] / parse_s:.1f} chunks/s parsed, "
+             f"{self.stats['indexed'] / elapsed:.1f} chunks/s indexed")
+        return self.stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Resumable bulk ingestion of a directory tree into the RAG index")
+    parser.add_argument("root", help="directory to ingest")
+    parser.add_argument("--index-dir", default="rag_index", help="where the retrieval index snapshot is kept")
+    parser.add_argument("--checkpoint", default=None, help="checkpoint file (default: <index-dir>/ingest_checkpoint.json)")
+    parser.add_argument("--batch-files", type=int, default=16, help="files per UPLOAD_DOCS message")
+    parser.add_argument("--queue-size", type=int, default=64, help="max scanned files waiting to be uploaded")
+    parser.add_argument("--snapshot-every", type=int, default=8, help="snapshot + checkpoint every N batches")
+    parser.add_argument("--timeout", type=float, default=None, help="seconds to wait for each batch/snapshot")
+    parser.add_argument("--embedding-model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--embedding-backend", default="torch")
+    parser.add_argument("--dedup-threshold", type=float, default=None)
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.index_dir, exist_ok=True)
+    checkpoint = Checkpoint(args.checkpoint or os.path.join(args.index_dir, "ingest_checkpoint.json"))
+    broker = MCPBroker(embedding_model=args.embedding_model, embedding_backend=args.embedding_backend,
+                       dedup_threshold=args.dedup_threshold, index_dir=os.path.join(args.index_dir, "snapshot"),
+                       # Snapshots must line up with checkpoint saves: a background snapshot would hold
+                       # chunks of files the checkpoint doesn't list, and a resume would index them twice.
+                       snapshot_interval_s=None)
+    broker.start()
+    try:
+        BulkIngester(broker, args.root, checkpoint, batch_files=args.batch_files, queue_size=args.queue_size,
+                     snapshot_every=args.snapshot_every, timeout=args.timeout).run()
+    finally:
+        broker.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import re
+import zlib
+from threading import Lock
+
+import numpy as np
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_WORD_RE = re.compile(r'\w+')
+
+def shingles(text: str, k: int = 5):
+    """Set of lowercased word k-grams; texts shorter than k words give a single shingle."""
+    words = _WORD_RE.findall(text.lower())
+    if len(words) <= k:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + k]) for i in range(len(words) - k + 1)}
+
+def _lsh_params(threshold: float, num_perm: int):
+    """Pick (bands, rows) with bands*rows <= num_perm whose S-curve midpoint is closest to threshold."""
+    best = None
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        midpoint = (1.0 / bands) ** (1.0 / rows)
+        err = abs(midpoint - threshold)
+        if best is None or err < best[0]:
+            best = (err, bands, rows)
+    return best[1], best[2]
+
+
+class NearDuplicateIndex:
+    """
+    MinHash signatures over word shingles, bucketed with banded LSH. `add` returns the id of an
+    already-indexed text whose estimated Jaccard similarity is >= threshold, or registers the
+    text as a new canonical entry and returns None.
+    """
+
+    def __init__(self, threshold: float = 0.85, num_perm: int = 128, shingle_size: int = 5, seed: int = 1):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, (1 << 61) - 1, size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, (1 << 61) - 1, size=num_perm, dtype=np.uint64)
+        self.bands, self.rows = _lsh_params(threshold, num_perm)
+        self._buckets = [dict() for _ in range(self.bands)]
+        self._signatures = {}
+        self.lock = Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = Lock()
+
+    def __len__(self):
+        return len(self._signatures)
+
+    def signature(self, text: str):
+        hv = np.fromiter((zlib.crc32(s.encode('utf-8')) for s in shingles(text, self.shingle_size)), dtype=np.uint64)
+        with np.errstate(over='ignore'):
+            phv = np.bitwise_and((np.outer(hv, self._a) + self._b) % _MERSENNE_PRIME, _MAX_HASH)
+        return phv.min(axis=0)
+
+    def _band_keys(self, sig):
+        r = self.rows
+        return [sig[i * r:(i + 1) * r].tobytes() for i in range(self.bands)]
+
+    def add(self, key, text: str):
+        sig = self.signature(text)
+        band_keys = self._band_keys(sig)
+        with self.lock:
+            best, best_sim = None, -1.0
+            seen = set()
+            for bucket, bk in zip(self._buckets, band_keys):
+                for cand in bucket.get(bk, ()):
+                    if cand in seen:
+                        continue
+                    seen.add(cand)
+                    sim = float(np.mean(self._signatures[cand] == sig))
+                    if sim > best_sim:
+                        best, best_sim = cand, sim
+            if best is not None and best_sim >= self.threshold:
+                return best
+            self._signatures[key] = sig
+            for bucket, bk in zip(self._buckets, band_keys):
+                bucket.setdefault(bk, []).append(key)
+            return None
+
+    def remove(self, keys):
+        """Forget the given canonical entries so later texts are no longer collapsed onto them."""
+        with self.lock:
+            for key in keys:
+                sig = self._signatures.pop(key, None)
+                if sig is None:
+                    continue
+                for bucket, bk in zip(self._buckets, self._band_keys(sig)):
+                    members = bucket.get(bk)
+                    if members and key in members:
+                        members.remove(key)
+                        if not members:
+                            del bucket[bk]
+
+
+if __name__ == "__main__":
+    import random
+    import time
+
+    # Synthetic corpus: unique pages plus lightly edited copies (a few words changed).
+    rng = random.Random(0)
+    vocab = [f"w{i}" for i in range(5000)]
+    pages = [rng.choices(vocab, k=150) for _ in range(4000)]
+    docs, truth = [], []
+    for i, p in enumerate(pages):
+        docs.append(" ".join(p)); truth.append(None)
+        if i % 4 == 0:
+            for _ in range(2):
+                q = list(p)
+                for _ in range(3):
+                    q[rng.randrange(len(q))] = rng.choice(vocab)
+                docs.append(" ".join(q)); truth.append(i)
+
+    for threshold in (0.7, 0.8, 0.9):
+        idx = NearDuplicateIndex(threshold=threshold)
+        t0 = time.perf_counter()
+        out = [idx.add(n, d) for n, d in enumerate(docs)]
+        elapsed = time.perf_counter() - t0
+        flagged = sum(o is not None for o in out)
+        true_dups = sum(t is not None for t in truth)
+        correct = sum(o is not None and t is not None for o, t in zip(out, truth))
+        print(f"threshold={threshold}: bands={idx.bands} rows={idx.rows} {len(docs) / elapsed:.0f} docs/s, "
+              f"collapsed {flagged}/{len(docs)} ({flagged / len(docs):.1%} saved), "
+              f"recall={correct / true_dups:.3f} precision={correct / max(flagged, 1):.3f}")
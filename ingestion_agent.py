@@ -1,14 +1,36 @@
 import io
+import os
+import queue
+import time
+from collections import deque
 from multiprocessing import Queue
 from typing import Dict, Any
-from utils import infer_and_read
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from utils import MmapReader, infer_and_read, is_tabular, iter_tables, iter_row_chunks, new_doc_id
+from text_splitter import RecursiveTextSplitter
+
+# Tabular files are streamed straight to the RetrievalAgent in CHUNKS_ADD batches of this size
+# instead of being collected into the INGESTION_COMPLETE message.
+TABLE_BATCH_CHUNKS = 256
+# Backpressure: at most this many of those batches may be queued but not yet indexed; parsing
+# waits for the RetrievalAgent's CHUNKS_INDEXED acknowledgements before sending more.
+MAX_PENDING_BATCHES = 4
+# Give up on an upload if the RetrievalAgent acknowledges nothing for this long.
+ACK_TIMEOUT_S = 600.0
 
 class IngestionAgent:
     def __init__(self, in_queue: Queue, out_queue: Queue):
         self.in_q = in_queue
         self.out_q = out_queue
-        self.splitter = RecursiveCharacterTextSplitter(chunk_size=800, chunk_overlap=100)
+        self.splitter = RecursiveTextSplitter(chunk_size=800, chunk_overlap=100)
+        self._pending_acks = set()
+        self._batch_seq = 0
+        # Messages that arrived while waiting for acknowledgements, handled after the current one.
+        self._deferred = deque()
+        # Called as a long upload makes progress, so the broker doesn't mistake it for a hang.
+        self.progress = lambda: None
+
+    def next_message(self):
+        return self._deferred.popleft() if self._deferred else self.in_q.get()
 
     def handle_upload(self, msg: Dict[str,Any]):
         files = msg['payload'].get('files', [])
@@ -18,31 +40,20 @@ class IngestionAgent:
         print("[IngestionAgent] Received upload request with", len(files), "files")
 
         for filename, b in files:
-            if isinstance(b, (bytes, bytearray)):
-                stream = io.BytesIO(b)
-            else:
-                stream = b
-            stream.seek(0)
-
-            doc_id, text = infer_and_read(filename, stream)
-            if not text.strip():
-                print(f"[IngestionAgent] No text parsed for {filename}")
+            self.progress()
+            # One unreadable file (corrupt PDF, bad XLSX) is reported in its result instead of failing the batch.
+            try:
+                result, records = self.ingest_file(filename, b, trace_id)
+            except TimeoutError:
+                # The RetrievalAgent stopped acknowledging: not this file's fault, so fail the upload.
+                raise
+            except Exception as e:
+                print(f"[IngestionAgent] Failed to ingest {filename}: {type(e).__name__}: {e}")
+                ingest_results.append({"doc_name": filename, "num_chunks": 0, "error": f"{type(e).__name__}: {e}"})
                 continue
-
-            chunks = self.splitter.split_text(text)
-            print(f"[IngestionAgent] Parsed {len(chunks)} chunks from {filename}")
-
-            for i, c in enumerate(chunks):
-                record = {
-                    "doc_id": doc_id,
-                    "doc_name": filename,
-                    "chunk_id": f"{doc_id}__{i}",
-                    "text": c,
-                    "meta": {"source": filename, "chunk_index": i},
-                }
-                all_chunk_records.append(record)
-
-            ingest_results.append({"doc_id": doc_id, "doc_name": filename, "num_chunks": len(chunks)})
+            if result is not None:
+                ingest_results.append(result)
+                all_chunk_records.extend(records)
 
         resp = {
             "type": "INGESTION_COMPLETE",
@@ -53,6 +64,129 @@ class IngestionAgent:
         print("[IngestionAgent] Ingestion complete, sending response with", len(all_chunk_records), "chunks")
         self.out_q.put(resp)
 
+    def ingest_file(self, filename, b, trace_id):
+        """
+        Parse one uploaded file (bytes, a stream or a path on disk). Returns (result, chunk_records),
+        or (None, []) if it has no text; tabular files are streamed and return no records.
+        """
+        if isinstance(b, str):
+            # A path on disk (bulk ingestion): read here instead of shipping the bytes over the queue.
+            with open(b, 'rb') as f:
+                if is_tabular(filename):
+                    return self.ingest_table(filename, f, trace_id), []
+                # mmap (0 bytes can't be mapped) so a large PDF/PPTX isn't read into memory a second time.
+                stream = MmapReader(f) if os.fstat(f.fileno()).st_size else io.BytesIO()
+        elif isinstance(b, (bytes, bytearray)):
+            stream = io.BytesIO(b)
+        else:
+            stream = b
+        stream.seek(0)
+
+        if is_tabular(filename):
+            return self.ingest_table(filename, stream, trace_id), []
+
+        try:
+            doc_id, text = infer_and_read(filename, stream, progress=self.progress)
+        finally:
+            if isinstance(stream, MmapReader):
+                stream.close()
+        if not text.strip():
+            print(f"[IngestionAgent] No text parsed for {filename}")
+            return None, []
+
+        chunks = self.splitter.split_offsets(text)
+        print(f"[IngestionAgent] Parsed {len(chunks)} chunks from {filename}")
+
+        records = []
+        for i, (start, end) in enumerate(chunks):
+            records.append({
+                "doc_id": doc_id,
+                "doc_name": filename,
+                "chunk_id": f"{doc_id}__{i}",
+                "text": text[start:end],
+                "meta": {"source": filename, "chunk_index": i, "char_start": start, "char_end": end},
+            })
+        return {"doc_id": doc_id, "doc_name": filename, "num_chunks": len(chunks)}, records
+
+    def _wait_for_acks(self, max_pending):
+        """Block until at most `max_pending` CHUNKS_ADD batches are still waiting to be indexed."""
+        deadline = time.time() + ACK_TIMEOUT_S
+        while len(self._pending_acks) > max_pending:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                n = len(self._pending_acks)
+                self._pending_acks.clear()
+                raise TimeoutError(f"RetrievalAgent acknowledged none of {n} pending batches in {ACK_TIMEOUT_S:.0f}s")
+            try:
+                msg = self.in_q.get(timeout=min(remaining, 1.0))
+            except queue.Empty:
+                continue
+            if msg.get('type') == 'CHUNKS_INDEXED':
+                # Replays after a RetrievalAgent restart can acknowledge a batch twice; discard() ignores that.
+                self._pending_acks.discard(msg.get('payload', {}).get('ack'))
+                self.progress()
+                deadline = time.time() + ACK_TIMEOUT_S
+            else:
+                self._deferred.append(msg)
+
+    def _send_chunks(self, chunks, trace_id):
+        self._wait_for_acks(MAX_PENDING_BATCHES - 1)
+        self.progress()
+        self._batch_seq += 1
+        ack = f"{trace_id}#{self._batch_seq}"
+        self._pending_acks.add(ack)
+        self.out_q.put({
+            "type": "CHUNKS_ADD",
+            "sender": "IngestionAgent",
+            "receiver": "RetrievalAgent",
+            "trace_id": trace_id,
+            "payload": {"chunks": chunks, "ack": ack},
+        })
+
+    def ingest_table(self, filename, stream, trace_id):
+        """
+        Stream a CSV/TSV/XLSX file as whole-row chunks that each repeat the header. Returns once the
+        RetrievalAgent has indexed every batch, so memory stays bounded by MAX_PENDING_BATCHES.
+        """
+        doc_id = new_doc_id(filename)
+        start = time.time()
+        batch = []
+        n_chunks = n_rows = 0
+        try:
+            for table, rows in iter_tables(filename, stream):
+                for text, first, last in iter_row_chunks(rows, max_chars=self.splitter.chunk_size):
+                    batch.append({
+                        "doc_id": doc_id,
+                        "doc_name": filename,
+                        "chunk_id": f"{doc_id}__{n_chunks}",
+                        "text": text,
+                        "meta": {"source": filename, "chunk_index": n_chunks, "table": table,
+                                 "row_start": first, "row_end": last},
+                    })
+                    n_chunks += 1
+                    n_rows += last - first + 1
+                    if len(batch) >= TABLE_BATCH_CHUNKS:
+                        self._send_chunks(batch, trace_id)
+                        batch = []
+        except Exception:
+            if n_chunks > len(batch):
+                # Batches already streamed would leave half the table indexed; take them back out.
+                self.out_q.put({
+                    "type": "CHUNKS_REMOVE",
+                    "sender": "IngestionAgent",
+                    "receiver": "RetrievalAgent",
+                    "trace_id": trace_id,
+                    "payload": {"doc_ids": [doc_id]},
+                })
+            raise
+        if batch:
+            self._send_chunks(batch, trace_id)
+        self._wait_for_acks(0)
+        elapsed = max(time.time() - start, 1e-9)
+        print(f"[IngestionAgent] Streamed {n_rows} rows into {n_chunks} chunks from {filename} "
+              f"in {elapsed:.2f}s ({n_rows / elapsed:.0f} rows/s)")
+        return {"doc_id": doc_id, "doc_name": filename, "num_chunks": n_chunks, "num_rows": n_rows}
+
     def run_once(self, msg):
         if msg.get('type') == 'UPLOAD_DOCS':
             self.handle_upload(msg)
@@ -0,0 +1,141 @@
+import heapq
+import math
+import re
+from collections import Counter
+from threading import Lock
+
+# Keeps identifiers like "7731-AX-09", "v2.3.1" or "user_id" together as one token.
+_TOKEN_RE = re.compile(r'[a-z0-9]+(?:[-_./:][a-z0-9]+)*')
+_SPLIT_RE = re.compile(r'[-_./:]')
+
+def tokenize(text: str):
+    """Lowercased terms; compound identifiers are indexed whole and as their parts."""
+    tokens = []
+    for tok in _TOKEN_RE.findall(text.lower()):
+        tokens.append(tok)
+        parts = _SPLIT_RE.split(tok)
+        if len(parts) > 1:
+            tokens.extend(p for p in parts if p)
+    return tokens
+
+def identifier_terms(text: str):
+    """
+    Tokens shaped like identifiers (part numbers, versions, SKUs): at least 4 characters with a
+    digit joined to letters or to a -_/: separator. Plain numbers ("2023", "3.6") and short
+    labels ("q3") don't count.
+    """
+    return [t for t in _TOKEN_RE.findall(text.lower())
+            if len(t) >= 4 and any(ch.isdigit() for ch in t)
+            and (any(ch.isalpha() for ch in t) or re.search(r'[-_/:]', t))]
+
+
+class BM25Index:
+    """In-memory BM25 inverted index, fed the same (texts, metas) stream as SimpleFAISS."""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}
+        self.doc_lens = []
+        self.metadatas = []
+        self.total_len = 0
+        # Removed chunks keep their slot (metadata None, length 0) so posting positions stay valid.
+        self.n_removed = 0
+        self.lock = Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = Lock()
+
+    def __len__(self):
+        return len(self.doc_lens) - self.n_removed
+
+    def doc_freq(self, term: str) -> int:
+        return len(self.postings.get(term, ()))
+
+    def add(self, texts, metas):
+        with self.lock:
+            for t, m in zip(texts, metas):
+                doc_idx = len(self.doc_lens)
+                tf = Counter(tokenize(t))
+                for term, n in tf.items():
+                    self.postings.setdefault(term, []).append((doc_idx, n))
+                dl = sum(tf.values())
+                self.doc_lens.append(dl)
+                self.total_len += dl
+                mm = m.copy()
+                mm['text'] = t
+                self.metadatas.append(mm)
+
+    def remove_docs(self, doc_ids):
+        """Drop the postings and metadata of every chunk whose doc_id is in `doc_ids`; returns the count."""
+        doc_ids = set(doc_ids)
+        with self.lock:
+            dead = [i for i, m in enumerate(self.metadatas) if m is not None and m.get('doc_id') in doc_ids]
+            # Only the removed chunks' own terms have postings to filter.
+            terms = set()
+            for i in dead:
+                terms.update(tokenize(self.metadatas[i]['text']))
+            dead_set = set(dead)
+            for term in terms:
+                plist = [p for p in self.postings.get(term, ()) if p[0] not in dead_set]
+                if plist:
+                    self.postings[term] = plist
+                else:
+                    self.postings.pop(term, None)
+            for i in dead:
+                self.total_len -= self.doc_lens[i]
+                self.doc_lens[i] = 0
+                self.metadatas[i] = None
+            self.n_removed += len(dead)
+            return len(dead)
+
+    def search(self, query: str, k: int = 10):
+        terms = set(tokenize(query))
+        with self.lock:
+            n_docs = len(self.doc_lens) - self.n_removed
+            if n_docs == 0 or not terms:
+                return []
+            avgdl = self.total_len / n_docs
+            scores = {}
+            for term in terms:
+                plist = self.postings.get(term)
+                if not plist:
+                    continue
+                idf = math.log(1 + (n_docs - len(plist) + 0.5) / (len(plist) + 0.5))
+                for doc_idx, tf in plist:
+                    norm = self.k1 * (1 - self.b + self.b * self.doc_lens[doc_idx] / avgdl)
+                    scores[doc_idx] = scores.get(doc_idx, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+            top = heapq.nlargest(k, scores.items(), key=lambda kv: kv[1])
+            return [{'score': float(s), 'meta': self.metadatas[i]} for i, s in top]
+
+
+if __name__ == "__main__":
+    import random
+    import time
+
+    # Synthetic part-number corpus: each doc mentions one unique ID among filler text.
+    rng = random.Random(0)
+    words = "pump valve seal gasket housing bracket flange motor bearing shaft assembly revision".split()
+    n_docs = 50000
+    ids = [f"{rng.randint(1000, 9999)}-{rng.choice('ABCDEFGH')}{rng.choice('XYZ')}-{i:05d}" for i in range(n_docs)]
+    texts = [" ".join(rng.choices(words, k=60)) + f" part {pid} " + " ".join(rng.choices(words, k=60)) for pid in ids]
+
+    idx = BM25Index()
+    t0 = time.perf_counter()
+    idx.add(texts, [{'chunk_id': str(i)} for i in range(n_docs)])
+    t1 = time.perf_counter()
+    print(f"indexed {n_docs} docs in {t1 - t0:.2f}s ({n_docs / (t1 - t0):.0f} docs/s), {len(idx.postings)} terms")
+
+    sample = rng.sample(range(n_docs), 1000)
+    hits, t0 = 0, time.perf_counter()
+    for i in sample:
+        res = idx.search(ids[i], k=10)
+        hits += any(r['meta']['chunk_id'] == str(i) for r in res)
+    elapsed = time.perf_counter() - t0
+    print(f"lexical: {elapsed / len(sample) * 1000:.2f} ms/query, recall@10={hits / len(sample):.3f}")
@@ -1,6 +1,8 @@
+import os
 import threading
 import time
-from multiprocessing import Queue, Process
+from collections import deque
+from multiprocessing import Queue, Process, Value
 from datetime import datetime
 import signal
 import sys
@@ -9,11 +11,25 @@ import agent_processes as ap
 
 _LOG_PREFIX = "[MCP Broker]"
 
+AGENT_NAMES = ("IngestionAgent", "RetrievalAgent", "LLMResponseAgent")
+# Attribute names holding each agent's (in, internal out) queues; swapped for fresh ones on restart.
+_AGENT_QUEUE_ATTRS = {
+    "IngestionAgent": ("ing_in", "ing_out_internal"),
+    "RetrievalAgent": ("ret_in", "ret_out_internal"),
+    "LLMResponseAgent": ("llm_in", "llm_out_internal"),
+}
+SUPERVISE_INTERVAL = 1.0
+# An index update that was in flight at this many consecutive RetrievalAgent crashes is dropped
+# from the replay log instead of being replayed into the next restart.
+POISON_CRASH_LIMIT = 3
+
 def _log(msg: str):
     print(f"[{datetime.now().isoformat()}] {_LOG_PREFIX} {msg}", flush=True)
 
 class MCPBroker:
-    def __init__(self, embedding_model="all-MiniLM-L6-v2", K_RETRIEVE=50, K_RERANK=10, llm_model="llama3.2:1b"):
+    def __init__(self, embedding_model="all-MiniLM-L6-v2", K_RETRIEVE=50, K_RERANK=10, llm_model="llama3.2:1b",
+                 embedding_backend="torch", retrieval_mode="dense", adaptive=False, dedup_threshold=None,
+                 index_dir=None, message_timeout=300.0, replay_limit=100000, snapshot_interval_s=300):
         self.ing_out_public = Queue()
         self.ret_out_public = Queue()
         self.llm_out_public = Queue()
@@ -37,6 +53,13 @@ class MCPBroker:
         self._broker_thread = None
         self._procs = []
         self.embedding_model = embedding_model
+        self.embedding_backend = embedding_backend
+        self.retrieval_mode = retrieval_mode
+        self.adaptive = adaptive
+        self.dedup_threshold = dedup_threshold
+        self.index_dir = index_dir
+        # Seconds between automatic snapshots to index_dir; None when the caller drives snapshots.
+        self.snapshot_interval_s = snapshot_interval_s
         self.K_RETRIEVE = K_RETRIEVE
         self.K_RERANK = K_RERANK
         self.llm_model = llm_model
@@ -59,27 +82,77 @@ class MCPBroker:
 
         self._method_lock = threading.Lock()
 
+        # Supervision: per-message progress stamps, in-flight traces to fail on a crash, and index updates
+        # (CHUNKS_ADD/CHUNKS_REMOVE) not yet covered by a retrieval snapshot, replayed into a
+        # restarted RetrievalAgent.
+        # An agent that spends longer than this on one message without reporting progress is treated as hung.
+        self.message_timeout = message_timeout
+        self.replay_limit = replay_limit
+        self._supervisor_thread = None
+        self._queue_lock = threading.Lock()
+        self._proc_by_name = {}
+        self._busy = {}
+        self._restart_at = {}
+        self._restart_pending = {}
+        # Agents between failure detection and AGENT_READY: calls to them fail fast and index
+        # updates for the RetrievalAgent are only logged, then replayed once it is ready.
+        self._down = set()
+        self._crash_streak = {}
+        # RetrievalAgent: sequence number of the index update it is handling (shared with the
+        # process), and [seq, consecutive crashes] of the update in flight at the last crash.
+        self._ret_inflight_seq = None
+        self._poison = [0, 0]
+        self.restart_stats = []
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        self._chunk_log = deque()
+        self._chunk_log_chunks = 0
+        self._chunk_seq = 0
+        self._chunk_log_dropped = 0
+        # Index updates a RetrievalAgent restart could not replay because the log had dropped them,
+        # or that were quarantined for crashing it; the live index is missing their chunks, so
+        # callers must not record them as indexed.
+        self.lost_index_updates = 0
+        # Index updates are stamped [session, seq]; a snapshot from another broker run (or none)
+        # covers nothing in this session's log.
+        self._session = uuid.uuid4().hex[:12]
+
+    def _agent_target(self, name):
+        if name == "IngestionAgent":
+            return ap.run_ingestion_agent, ()
+        if name == "RetrievalAgent":
+            return ap.run_retrieval_agent, (self.K_RETRIEVE, self.K_RERANK, self.embedding_model,
+                                            self.embedding_backend, self.retrieval_mode, self.adaptive,
+                                            self.dedup_threshold, self.index_dir, self.snapshot_interval_s)
+        return ap.run_llm_agent, (self.llm_model,)
+
+    def _spawn(self, name):
+        target, extra = self._agent_target(name)
+        busy = Value('d', 0.0)
+        kwargs = {'busy': busy}
+        if name == "RetrievalAgent":
+            kwargs['index_seq'] = self._ret_inflight_seq = Value('q', 0)
+        p = Process(target=target, args=(self._in_queues[name], self._internal_outs[name]) + extra,
+                    kwargs=kwargs, daemon=True)
+        p.start()
+        self._busy[name] = busy
+        self._proc_by_name[name] = p
+        self._procs = list(self._proc_by_name.values())
+        _log(f"{name} started (pid={p.pid})")
+
     def start(self):
         _log("Starting agent processes...")
-
-        p_ing = Process(target=ap.run_ingestion_agent, args=(self.ing_in, self.ing_out_internal), daemon=True)
-        p_ret = Process(
-            target=ap.run_retrieval_agent,
-            args=(self.ret_in, self.ret_out_internal, self.K_RETRIEVE, self.K_RERANK, self.embedding_model),
-            daemon=True,
-        )
-        p_llm = Process(target=ap.run_llm_agent, args=(self.llm_in, self.llm_out_internal, self.llm_model), daemon=True)
-
-        p_ing.start(); _log(f"IngestionAgent started (pid={p_ing.pid})")
-        p_ret.start(); _log(f"RetrievalAgent started (pid={p_ret.pid})")
-        p_llm.start(); _log(f"LLMResponseAgent started (pid={p_llm.pid})")
-
-        self._procs = [p_ing, p_ret, p_llm]
+        for name in AGENT_NAMES:
+            self._spawn(name)
 
         self._broker_thread = threading.Thread(target=self._broker_loop, daemon=True)
         self._broker_thread.start()
         _log("Broker thread started.")
 
+        self._supervisor_thread = threading.Thread(target=self._supervisor_loop, daemon=True)
+        self._supervisor_thread.start()
+        _log("Supervisor thread started.")
+
         try:
             signal.signal(signal.SIGINT, self._signal_handler)
             signal.signal(signal.SIGTERM, self._signal_handler)
@@ -91,42 +164,201 @@ class MCPBroker:
         self.stop()
         sys.exit(0)
 
+    def _supervisor_loop(self):
+        while not self._stop_event.wait(SUPERVISE_INTERVAL):
+            now = time.time()
+            for name in AGENT_NAMES:
+                try:
+                    if name in self._restart_at:
+                        if now >= self._restart_at[name]:
+                            del self._restart_at[name]
+                            self._restart(name)
+                        continue
+                    p = self._proc_by_name.get(name)
+                    if p is None:
+                        continue
+                    busy_since = self._busy[name].value
+                    if not p.is_alive():
+                        self._on_agent_failure(name, f"died (exitcode={p.exitcode})")
+                    elif busy_since and now - busy_since > self.message_timeout:
+                        self._on_agent_failure(name, f"made no progress on a message for {now - busy_since:.0f}s")
+                except Exception as e:
+                    _log(f"Supervisor error for {name}: {e}")
+
+    def _on_agent_failure(self, name, reason):
+        p = self._proc_by_name[name]
+        _log(f"{name} (pid={p.pid}) {reason}; failing in-flight traces and restarting")
+        in_attr, out_attr = _AGENT_QUEUE_ATTRS[name]
+        with self._queue_lock:
+            # From here on _post raises for this agent, so no call can land in a queue nobody reads.
+            self._down.add(name)
+            # The dead process may have died holding a queue's internal lock, so use fresh queues.
+            self._in_queues[name] = Queue()
+            self._internal_outs[name] = Queue()
+            setattr(self, in_attr, self._in_queues[name])
+            setattr(self, out_attr, self._internal_outs[name])
+        if p.is_alive():
+            p.terminate()
+            p.join(timeout=2.0)
+            if p.is_alive():
+                p.kill()
+        self._fail_inflight(name, f"{name} {reason}")
+        if name == "RetrievalAgent":
+            self._check_poison_update(self._ret_inflight_seq.value, reason)
+        streak = self._crash_streak[name] = self._crash_streak.get(name, 0) + 1
+        # Back off if the agent keeps dying before it ever reports AGENT_READY.
+        delay = 0.0 if streak == 1 else min(60.0, 2.0 ** (streak - 1))
+        if delay:
+            _log(f"{name} failed {streak} times without becoming ready; restarting in {delay:.0f}s")
+        self._restart_pending.setdefault(name, {'detected': time.time()})
+        self._restart_at[name] = time.time() + delay
+
+    def _restart(self, name):
+        with self._queue_lock:
+            # Before the process starts: its AGENT_READY can reach the broker thread within milliseconds.
+            self._restart_pending[name]['spawned'] = time.time()
+            self._spawn(name)
+
+    def _on_agent_ready(self, name, msg):
+        self._crash_streak[name] = 0
+        pending = self._restart_pending.pop(name, None)
+        if pending is None:
+            _log(f"{name} ready")
+            return
+        now = time.time()
+        with self._queue_lock:
+            try:
+                total = now - pending.get('detected', now)
+                spawn_to_ready = now - pending.get('spawned', now)
+                self.restart_stats.append({'agent': name, 'seconds': total, 'spawn_to_ready': spawn_to_ready})
+                _log(f"{name} restarted in {total:.2f}s (spawn to ready {spawn_to_ready:.2f}s)")
+                if name == "RetrievalAgent":
+                    session, seq = msg.get('payload', {}).get('index_seq') or (None, 0)
+                    self._replay_chunks(seq if session == self._session else 0)
+            finally:
+                # Whatever went wrong above, an agent left in _down would reject every call forever.
+                self._down.discard(name)
+
+    def _check_poison_update(self, seq, reason):
+        """Quarantine index update `seq` once it has been in flight at POISON_CRASH_LIMIT crashes in a row."""
+        if not seq:
+            return
+        self._poison = [seq, self._poison[1] + 1] if self._poison[0] == seq else [seq, 1]
+        if self._poison[1] < POISON_CRASH_LIMIT:
+            return
+        with self._queue_lock:
+            entry = next((e for e in self._chunk_log if e[0] == seq), None)
+            if entry is None:
+                return
+            self._chunk_log = deque(e for e in self._chunk_log if e[0] != seq)
+            self._chunk_log_chunks -= entry[2]
+            # Its chunks are not in the index, just like updates the replay log dropped.
+            self.lost_index_updates += 1
+        msg = entry[1]
+        _log(f"Quarantined index update #{seq} ({msg.get('type')}, trace={msg.get('trace_id')}): the RetrievalAgent "
+             f"{reason} while handling it {self._poison[1]} times in a row; it will not be replayed")
+        self._fail_trace(msg.get('trace_id'), f"RetrievalAgent {reason} repeatedly on this index update; it was dropped")
+
+    def _send_index_update(self, msg):
+        """Route CHUNKS_ADD/CHUNKS_REMOVE to the RetrievalAgent, keeping it in the replay log until a snapshot covers it."""
+        with self._queue_lock:
+            self._chunk_seq += 1
+            msg = dict(msg, index_seq=[self._session, self._chunk_seq])
+            n = len(msg.get('payload', {}).get('chunks', [])) or 1
+            self._chunk_log.append((self._chunk_seq, msg, n))
+            self._chunk_log_chunks += n
+            while self._chunk_log_chunks > self.replay_limit and len(self._chunk_log) > 1:
+                _, _, dropped = self._chunk_log.popleft()
+                self._chunk_log_chunks -= dropped
+                self._chunk_log_dropped += 1
+            # While the agent is down the update is only logged; _on_agent_ready replays it in order.
+            if 'RetrievalAgent' not in self._down:
+                self._in_queues['RetrievalAgent'].put(msg)
+
+    def _on_snapshot_complete(self, payload):
+        # Only the snapshot in index_dir is reloaded on restart; one saved elsewhere covers nothing.
+        path = payload.get('path')
+        if not self.index_dir or not path or os.path.abspath(path) != os.path.abspath(self.index_dir):
+            return
+        session, seq = payload.get('index_seq') or (None, 0)
+        if session == self._session:
+            self._trim_chunk_log(seq)
+
+    def _trim_chunk_log(self, upto_seq):
+        with self._queue_lock:
+            while self._chunk_log and self._chunk_log[0][0] <= upto_seq:
+                _, _, n = self._chunk_log.popleft()
+                self._chunk_log_chunks -= n
+
+    def _replay_chunks(self, after_seq):
+        """Queue every logged index update after `after_seq` for the RetrievalAgent; call with _queue_lock held."""
+        upto_seq = self._chunk_seq
+        entries = [(seq, m) for seq, m, _ in self._chunk_log if after_seq < seq]
+        for _, m in entries:
+            self._in_queues['RetrievalAgent'].put(m)
+        oldest = self._chunk_log[0][0] if self._chunk_log else upto_seq + 1
+        if oldest > after_seq + 1 and after_seq < upto_seq:
+            self.lost_index_updates += min(oldest, upto_seq + 1) - after_seq - 1
+            _log(f"Replay log no longer holds index updates {after_seq + 1}..{oldest - 1} "
+                 f"(replay_limit={self.replay_limit}); those chunks are missing until re-ingested")
+        _log(f"Replayed {len(entries)} index updates not covered by the snapshot (after #{after_seq})")
+
+    def _track(self, trace_id, public_q, agents):
+        with self._inflight_lock:
+            self._inflight[trace_id] = (public_q, set(agents))
+
+    def _untrack(self, trace_id):
+        with self._inflight_lock:
+            self._inflight.pop(trace_id, None)
+
+    def _fail_inflight(self, agent_name, reason):
+        with self._inflight_lock:
+            failed = [(t, q) for t, (q, agents) in self._inflight.items() if agent_name in agents]
+        for trace_id, q in failed:
+            _log(f"Failing in-flight trace={trace_id}: {reason}")
+            q.put({'type': 'ERROR', 'sender': 'MCPBroker', 'trace_id': trace_id, 'payload': {'error': reason}})
+
+    def _fail_trace(self, trace_id, reason):
+        with self._inflight_lock:
+            waiting = self._inflight.get(trace_id)
+        if waiting:
+            _log(f"Failing trace={trace_id}: {reason}")
+            waiting[0].put({'type': 'ERROR', 'sender': 'MCPBroker', 'trace_id': trace_id, 'payload': {'error': reason}})
+
+    def _post(self, receiver, msg):
+        with self._queue_lock:
+            if receiver in self._down:
+                raise RuntimeError(f"{receiver} is restarting; retry shortly")
+            self._in_queues[receiver].put(msg)
+
     def _broker_loop(self):
-        internal_map = self._internal_outs
         public_map = self._public_outs
         in_map = self._in_queues
 
-        entries = list(internal_map.items())
         poll_sleep = 0.05
         _log("Entering broker loop. Routing messages between agents.")
 
         while not self._stop_event.is_set():
             any_msg = False
-            for agent_name, q in entries:
+            for agent_name, q in list(self._internal_outs.items()):
                 try:
                     msg = q.get(timeout=0.01)
                 except Exception:
                     continue
                 any_msg = True
 
-                try:
-                    public_q = public_map.get(agent_name)
-                    if public_q:
-                        try:
-                            public_q.put(dict(msg))
-                        except Exception:
-                            public_q.put(msg)
-                except Exception as e:
-                    _log(f"Failed to put into public out queue for {agent_name}: {e}")
-
                 try:
                     receiver = msg.get("receiver")
                     if receiver in in_map:
                         try:
-                            in_map[receiver].put(msg)
+                            if receiver == 'RetrievalAgent' and msg.get('type') in ('CHUNKS_ADD', 'CHUNKS_REMOVE'):
+                                self._send_index_update(msg)
+                            else:
+                                self._post(receiver, msg)
                             _log(f"Routed msg type={msg.get('type')} trace={msg.get('trace_id')} from {msg.get('sender')} -> {receiver}")
                         except Exception as e:
                             _log(f"Failed to route msg to {receiver}: {e}")
+                            self._fail_trace(msg.get('trace_id'), str(e))
                     else:
                         _log(f"Public message from {msg.get('sender')} to {receiver} (type={msg.get('type')})")
 
@@ -141,7 +373,7 @@ class MCPBroker:
                                 'payload': {'chunks': chunks},
                             }
                             try:
-                                in_map['RetrievalAgent'].put(forward_msg)
+                                self._send_index_update(forward_msg)
                                 _log(f"Auto-forwarded {len(chunks)} chunks to RetrievalAgent (trace={msg.get('trace_id')})")
                             except Exception as e:
                                 _log(f"Failed to auto-forward chunks to RetrievalAgent: {e}")
@@ -150,7 +382,7 @@ class MCPBroker:
                         top_chunks = msg['payload']['retrieved_context']
                         query = msg['payload']['query']
                         trace = msg.get('trace_id')
-                        if chunks:
+                        if top_chunks is not None:
                             forward_msg = {
                                 'type': 'RETRIEVAL_RESULT',
                                 'sender': 'MCPBroker',
@@ -159,13 +391,40 @@ class MCPBroker:
                                 'payload': {'retrieved_context': top_chunks, 'query': query}
                             }
                             try:
-                                in_map['LLMResponseAgent'].put(forward_msg)
-                                _log(f"Auto-forwarded {len(chunks)} chunks to LLMResponseAgent (trace={msg.get('trace_id')})")
+                                self._post('LLMResponseAgent', forward_msg)
+                                _log(f"Auto-forwarded {len(top_chunks)} chunks to LLMResponseAgent (trace={msg.get('trace_id')})")
                             except Exception as e:
                                 _log(f"Failed to auto-forward chunks to LLMResponseAgent: {e}")
+                                self._fail_trace(trace, str(e))
+
+                    if msg.get('type') == 'AGENT_READY':
+                        self._on_agent_ready(agent_name, msg)
+                    elif msg.get('type') == 'SNAPSHOT_COMPLETE':
+                        self._on_snapshot_complete(msg.get('payload', {}))
+                    elif msg.get('type') == 'ERROR':
+                        # Deliver agent errors to whoever waits on the trace, even on another agent's queue.
+                        with self._inflight_lock:
+                            waiting = self._inflight.get(msg.get('trace_id'))
+                        if waiting and waiting[0] is not public_map.get(agent_name):
+                            waiting[0].put(dict(msg))
                 except Exception as e:
                     _log(f"Error during routing: {e}")
 
+                # Publish only after forwarding, so anyone reacting to the public copy (e.g. a
+                # SNAPSHOT_INDEX after INGESTION_COMPLETE) is queued behind the forwarded chunks.
+                # CHUNKS_INDEXED is flow control between agents and nobody reads it publicly.
+                if msg.get('type') == 'CHUNKS_INDEXED':
+                    continue
+                try:
+                    public_q = public_map.get(agent_name)
+                    if public_q:
+                        try:
+                            public_q.put(dict(msg))
+                        except Exception:
+                            public_q.put(msg)
+                except Exception as e:
+                    _log(f"Failed to put into public out queue for {agent_name}: {e}")
+
             if not any_msg:
                 time.sleep(poll_sleep)
 
@@ -176,6 +435,8 @@ class MCPBroker:
         self._stop_event.set()
         if self._broker_thread:
             self._broker_thread.join(timeout=2.0)
+        if self._supervisor_thread:
+            self._supervisor_thread.join(timeout=2.0)
 
         if terminate_procs:
             for p in self._procs:
@@ -212,24 +473,113 @@ class MCPBroker:
                 "payload": {"files": files},
             }
             _log(f"Posting UPLOAD_DOCS trace={trace_id} files={len(files)}")
-            self.ing_in.put(msg)
-            start = time.time()
-            while True:
-                if timeout is not None and (time.time() - start) > timeout:
-                    raise TimeoutError("upload_files timed out waiting for INGESTION_COMPLETE")
-                try:
-                    resp = self.ing_out_public.get(timeout=0.5)
+            self._track(trace_id, self.ing_out_public, ("IngestionAgent",))
+            try:
+                self._post("IngestionAgent", msg)
+                start = time.time()
+                while True:
+                    if timeout is not None and (time.time() - start) > timeout:
+                        raise TimeoutError("upload_files timed out waiting for INGESTION_COMPLETE")
+                    try:
+                        resp = self.ing_out_public.get(timeout=0.5)
+                    except Exception:
+                        continue
                     _log(f"Received from ingestion: {resp.get('type')} trace={resp.get('trace_id')}")
                     if resp.get("type") == "INGESTION_COMPLETE" and resp.get("trace_id") == trace_id:
                         chunks = resp["payload"].get("chunks", [])
                         _log(f"INGESTION_COMPLETE: got {len(chunks)} chunks (trace={trace_id})")
                         return resp
+                    elif resp.get("type") == "ERROR" and resp.get("trace_id") == trace_id:
+                        raise RuntimeError(f"upload_files failed: {resp.get('payload', {}).get('error')}")
                     else:
                         _log(f"Ignoring ingestion message type={resp.get('type')} trace={resp.get('trace_id')}")
-                except Exception:
-                    continue
+            finally:
+                self._untrack(trace_id)
+
+    def remove_docs(self, doc_ids):
+        """
+        Remove all chunks of `doc_ids` from the retrieval index. Applied in order with later
+        CHUNKS_ADD messages (so an upload posted afterwards is indexed after the removal) and
+        persisted by the next snapshot.
+        """
+        doc_ids = list(doc_ids)
+        if not doc_ids:
+            return
+        trace_id = f"remove-{int(time.time()*1000)}-{uuid.uuid4().hex[:6]}"
+        _log(f"Posting CHUNKS_REMOVE trace={trace_id} docs={len(doc_ids)}")
+        self._send_index_update({
+            "type": "CHUNKS_REMOVE",
+            "sender": "MCPBroker",
+            "receiver": "RetrievalAgent",
+            "trace_id": trace_id,
+            "payload": {"doc_ids": doc_ids},
+        })
+
+    def snapshot_index(self, path=None, timeout=None):
+        """Ask the RetrievalAgent to persist its index (default: index_dir) and wait for SNAPSHOT_COMPLETE."""
+        with self._method_lock:
+            trace_id = f"snapshot-{int(time.time()*1000)}-{uuid.uuid4().hex[:6]}"
+            msg = {
+                "type": "SNAPSHOT_INDEX",
+                "sender": "MCPBroker",
+                "receiver": "RetrievalAgent",
+                "trace_id": trace_id,
+                "payload": {"path": path} if path else {},
+            }
+            _log(f"Posting SNAPSHOT_INDEX trace={trace_id}")
+            self._track(trace_id, self.ret_out_public, ("RetrievalAgent",))
+            try:
+                self._post("RetrievalAgent", msg)
+                start = time.time()
+                while True:
+                    if timeout is not None and (time.time() - start) > timeout:
+                        raise TimeoutError("snapshot_index timed out waiting for SNAPSHOT_COMPLETE")
+                    try:
+                        resp = self.ret_out_public.get(timeout=0.5)
+                    except Exception:
+                        continue
+                    if resp.get("type") == "SNAPSHOT_COMPLETE" and resp.get("trace_id") == trace_id:
+                        _log(f"SNAPSHOT_COMPLETE: {resp['payload'].get('num_chunks')} chunks at {resp['payload'].get('path')}")
+                        return resp
+                    if resp.get("type") == "ERROR" and resp.get("trace_id") == trace_id:
+                        raise RuntimeError(f"snapshot_index failed: {resp.get('payload', {}).get('error')}")
+            finally:
+                self._untrack(trace_id)
 
-    def ask_query(self, query, timeout=None):
+    def retrieve_many(self, queries, mode=None, timeout=None):
+        """Retrieve context for many queries in one RETRIEVAL_BATCH_REQUEST; returns {query: top_chunks}."""
+        with self._method_lock:
+            trace_id = f"batch-{int(time.time()*1000)}-{uuid.uuid4().hex[:6]}"
+            msg = {
+                "type": "RETRIEVAL_BATCH_REQUEST",
+                "sender": "MCPBroker",
+                "receiver": "RetrievalAgent",
+                "trace_id": trace_id,
+                "payload": {"queries": list(queries)},
+            }
+            if mode is not None:
+                msg["payload"]["mode"] = mode
+            _log(f"Posting RETRIEVAL_BATCH_REQUEST trace={trace_id} queries={len(msg['payload']['queries'])}")
+            self._track(trace_id, self.ret_out_public, ("RetrievalAgent",))
+            try:
+                self._post("RetrievalAgent", msg)
+                start = time.time()
+                while True:
+                    if timeout is not None and (time.time() - start) > timeout:
+                        raise TimeoutError("retrieve_many timed out waiting for RETRIEVAL_BATCH_COMPLETE")
+                    try:
+                        resp = self.ret_out_public.get(timeout=0.5)
+                    except Exception:
+                        continue
+                    if resp.get("type") == "RETRIEVAL_BATCH_COMPLETE" and resp.get("trace_id") == trace_id:
+                        _log(f"RETRIEVAL_BATCH_COMPLETE: {len(resp['payload']['results'])} queries (trace={trace_id})")
+                        return resp["payload"]["results"]
+                    if resp.get("type") == "ERROR" and resp.get("trace_id") == trace_id:
+                        raise RuntimeError(f"retrieve_many failed: {resp.get('payload', {}).get('error')}")
+            finally:
+                self._untrack(trace_id)
+
+    def ask_query(self, query, timeout=None, latency_budget_ms=None):
         with self._method_lock:
             trace_id = f"query-{int(time.time()*1000)}-{uuid.uuid4().hex[:6]}"
             msg = {
@@ -239,27 +589,39 @@ class MCPBroker:
                 "trace_id": trace_id,
                 "payload": {"query": query},
             }
+            if latency_budget_ms is not None:
+                msg["payload"]["latency_budget_ms"] = latency_budget_ms
             _log(f"Posting RETRIEVAL_REQUEST trace={trace_id} q='{query[:120]}'")
-            self.ret_in.put(msg)
-
-            start = time.time()
-            _log("Waiting for LLM_ANSWER on llm_out...")
-            while True:
-                if timeout is not None and (time.time() - start) > timeout:
-                    raise TimeoutError("ask_query timed out waiting for LLM_ANSWER")
-
-                try:
-                    llm_msg = self.llm_out_public.get(timeout=0.5)
+            self._track(trace_id, self.llm_out_public, ("RetrievalAgent", "LLMResponseAgent"))
+            try:
+                self._post("RetrievalAgent", msg)
+
+                start = time.time()
+                _log("Waiting for LLM_ANSWER on llm_out...")
+                while True:
+                    if timeout is not None and (time.time() - start) > timeout:
+                        raise TimeoutError("ask_query timed out waiting for LLM_ANSWER")
+
+                    try:
+                        llm_msg = self.llm_out_public.get(timeout=0.5)
+                    except Exception:
+                        continue
                     _log(f"Got message from llm_out: type={llm_msg.get('type')} trace={llm_msg.get('trace_id')}")
                     if llm_msg.get("type") == "LLM_ANSWER" and llm_msg.get("trace_id") == trace_id:
                         _log("Received matching LLM_ANSWER -> returning to UI")
                         return llm_msg
+                    elif llm_msg.get("type") == "ERROR" and llm_msg.get("trace_id") == trace_id:
+                        raise RuntimeError(f"ask_query failed: {llm_msg.get('payload', {}).get('error')}")
                     else:
                         _log(f"Ignoring llm_out message type={llm_msg.get('type')} trace={llm_msg.get('trace_id')}")
-                except Exception:
-                    continue
-
-def start_mcp(embedding_model="all-MiniLM-L6-v2", K_RETRIEVE=50, K_RERANK=10, llm_model="llama3.2:1b"):
-    b = MCPBroker(embedding_model=embedding_model, K_RETRIEVE=K_RETRIEVE, K_RERANK=K_RERANK, llm_model=llm_model)
+            finally:
+                self._untrack(trace_id)
+
+def start_mcp(embedding_model="all-MiniLM-L6-v2", K_RETRIEVE=50, K_RERANK=10, llm_model="llama3.2:1b",
+              embedding_backend="torch", retrieval_mode="dense", adaptive=False, dedup_threshold=None,
+              index_dir=None, message_timeout=300.0):
+    b = MCPBroker(embedding_model=embedding_model, K_RETRIEVE=K_RETRIEVE, K_RERANK=K_RERANK, llm_model=llm_model,
+                  embedding_backend=embedding_backend, retrieval_mode=retrieval_mode, adaptive=adaptive,
+                  dedup_threshold=dedup_threshold, index_dir=index_dir, message_timeout=message_timeout)
     b.start()
     return b, b.get_queues_for_coordinator()
\ No newline at end of file
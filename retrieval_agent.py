@@ -2,23 +2,85 @@ from multiprocessing import Queue
 from typing import Dict, Any, List
 from sentence_transformers import CrossEncoder
 from vector_store import SimpleFAISS
+from lexical_index import BM25Index, identifier_terms
+from dedup import NearDuplicateIndex
 from datetime import datetime
+import os
+import pickle
+import shutil
 import time
 
+RETRIEVAL_MODES = ('dense', 'lexical', 'hybrid', 'auto')
+RRF_K = 60
+# Pairs per CrossEncoder forward pass when reranking a pooled batch of queries.
+RERANK_BATCH_SIZE = 64
+# Chunks embedded per step of a CHUNKS_ADD, reporting progress between steps.
+INDEX_BATCH_CHUNKS = 512
+
+# Adaptive retrieval: cut dense candidates at a distance gap ADAPTIVE_GAP_FACTOR times the mean
+# spacing (keeping at least ADAPTIVE_MIN_KEEP), then rerank in stages with early exit.
+ADAPTIVE_MIN_KEEP = 3
+ADAPTIVE_GAP_FACTOR = 3.0
+ADAPTIVE_STAGE_SIZE = 4
+ADAPTIVE_STABLE_TOP = 3
+
 def _log(msg):
     print(f"[{datetime.now().isoformat()}] [RetrievalAgent] {msg}")
 
+def _as_candidates(raw_results):
+    return [{'text': r['meta'].get('text', ''), 'meta': r['meta'], 'score': r['score']} for r in raw_results]
+
+def _to_top_chunks(final):
+    return [{'text': c['text'], 'meta': c['meta'], 'score': c.get('rerank_score', c.get('score'))} for c in final]
+
+def _gap_cut(candidates, min_keep=ADAPTIVE_MIN_KEEP, factor=ADAPTIVE_GAP_FACTOR):
+    """Cut L2-ascending candidates at the first gap much wider than the average spacing."""
+    if len(candidates) <= min_keep:
+        return candidates, False
+    scores = [c['score'] for c in candidates]
+    spread = scores[-1] - scores[0]
+    if spread <= 0:
+        return candidates, False
+    mean_gap = spread / (len(scores) - 1)
+    for i in range(min_keep, len(scores)):
+        if scores[i] - scores[i - 1] > factor * mean_gap:
+            return candidates[:i], True
+    return candidates, False
+
 class RetrievalAgent:
     def __init__(self, in_q: Queue, out_q: Queue,
                  K_RETRIEVE=50, K_RERANK=10, rerank_model='cross-encoder/ms-marco-MiniLM-L-6-v2',
-                 embedding_model='all-MiniLM-L6-v2'):
+                 embedding_model='all-MiniLM-L6-v2', embedding_backend='torch',
+                 retrieval_mode='dense', adaptive=False, dedup_threshold=None, index_dir=None,
+                 snapshot_interval_s=300):
         self.in_q = in_q
         self.out_q = out_q
         self.K_RETRIEVE = K_RETRIEVE
         self.K_RERANK = K_RERANK
+        self.retrieval_mode = retrieval_mode
+        self.mode_stats = {}
+        self.adaptive = adaptive
+        self.shortcut_stats = {'queries': 0, 'gap_cut': 0, 'early_exit': 0, 'budget_exit': 0}
         _log("Initializing SimpleFAISS and (maybe) reranker...")
-        self.vs = SimpleFAISS(model_name=embedding_model)
-        _log(f"Loaded embedding model (dim={self.vs.dim}).")
+        self.vs = SimpleFAISS(model_name=embedding_model, backend=embedding_backend)
+        _log(f"Loaded embedding model (dim={self.vs.dim}, backend={self.vs.encoder.name}).")
+        self.lexical = BM25Index()
+        self.dedup = NearDuplicateIndex(threshold=dedup_threshold) if dedup_threshold else None
+        self.dedup_stats = {'seen': 0, 'collapsed': 0}
+        self._duplicates = {}
+        # Full chunks collapsed onto a canonical one, by chunk_id, so they can be indexed in its
+        # place if the canonical chunk's document is removed.
+        self._duplicate_chunks = {}
+        self.index_dir = index_dir
+        # [broker session, sequence number] of the last CHUNKS_ADD/CHUNKS_REMOVE applied, as stamped by
+        # MCPBroker; saved with snapshots so a broker can replay the updates a snapshot doesn't cover.
+        self.index_seq = None
+        self.snapshot_interval_s = snapshot_interval_s
+        # Called between indexing steps of a large CHUNKS_ADD so the broker doesn't mistake it for a hang.
+        self.progress = lambda: None
+        self._last_snapshot = time.time()
+        if index_dir:
+            self.load_snapshot(index_dir)
         self.reranker = None
         if K_RERANK and rerank_model:
             _log(f"Loading reranker model: {rerank_model}")
@@ -28,9 +90,21 @@ class RetrievalAgent:
     def handle_chunks_add(self, chunks: List[Dict[str,Any]]):
         _log(f"Received CHUNKS_ADD with {len(chunks)} chunks — starting indexing")
         start = time.time()
-        texts = [c['text'] for c in chunks]
+        texts = []
         metas = []
+        n_dups = 0
         for c in chunks:
+            ref = {k: c.get(k) for k in ('doc_id', 'chunk_id', 'doc_name')}
+            ref['source'] = c.get('meta', {}).get('source')
+            ref['chunk_index'] = c.get('meta', {}).get('chunk_index')
+            if self.dedup is not None:
+                canonical = self.dedup.add(c.get('chunk_id'), c['text'])
+                if canonical is not None:
+                    # Near-duplicate: record it on the canonical chunk instead of embedding it again.
+                    self._duplicates[canonical].append(ref)
+                    self._duplicate_chunks[c.get('chunk_id')] = c
+                    n_dups += 1
+                    continue
             meta = {
                 'doc_id': c.get('doc_id'),
                 'chunk_id': c.get('chunk_id'),
@@ -39,27 +113,88 @@ class RetrievalAgent:
                 'chunk_index': c.get('meta', {}).get('chunk_index'),
                 'text': c.get('text') 
             }
+            # Keep splitter/table positions (char_start/char_end, table, row_start/row_end).
+            for k, v in c.get('meta', {}).items():
+                meta.setdefault(k, v)
+            # Shared (not copied) by the FAISS and BM25 metadata so later duplicates show up in both.
+            meta['duplicates'] = self._duplicates.setdefault(c.get('chunk_id'), [])
+            texts.append(c['text'])
             metas.append(meta)
 
-        self.vs.add(texts, metas)
+        for i in range(0, len(texts), INDEX_BATCH_CHUNKS):
+            self.vs.add(texts[i:i + INDEX_BATCH_CHUNKS], metas[i:i + INDEX_BATCH_CHUNKS])
+            self.lexical.add(texts[i:i + INDEX_BATCH_CHUNKS], metas[i:i + INDEX_BATCH_CHUNKS])
+            self.progress()
         elapsed = time.time() - start
         total = getattr(self.vs.index, "ntotal", "unknown")
-        _log(f"Indexed {len(chunks)} chunks in {elapsed:.2f}s. Total vectors now: {total}")
+        _log(f"Indexed {len(texts)} chunks in {elapsed:.2f}s. Total vectors now: {total}")
+        if self.dedup is not None:
+            self.dedup_stats['seen'] += len(chunks)
+            self.dedup_stats['collapsed'] += n_dups
+            seen, collapsed = self.dedup_stats['seen'], self.dedup_stats['collapsed']
+            _log(f"Collapsed {n_dups}/{len(chunks)} near-duplicate chunks "
+                 f"(total {collapsed}/{seen}, {collapsed / max(seen, 1):.1%} of vectors saved)")
 
-    def do_retrieval(self, msg: Dict[str,Any]):
-        query = msg['payload']['query']
-        trace = msg.get('trace_id')
-        _log(f"RETRIEVAL_REQUEST trace={trace} q='{query[:120]}' — searching top {self.K_RETRIEVE}")
+    def handle_chunks_remove(self, doc_ids):
+        """
+        Remove every chunk of `doc_ids` from FAISS, BM25 and the near-duplicate index. Near-duplicates
+        of other documents that were collapsed onto a removed chunk are indexed again in its place.
+        """
+        doc_ids = set(doc_ids)
         start = time.time()
-        raw_results = self.vs.search(query, k=self.K_RETRIEVE)
-        elapsed = time.time() - start
-        _log(f"FAISS search returned {len(raw_results)} candidates in {elapsed:.2f}s")
-        candidates = []
-        for r in raw_results:
-            meta = r['meta']
-            text = meta.get('text', '')
-            candidates.append({'text': text, 'meta': meta, 'score': r['score']})
-        final = candidates
+        removed = self.vs.remove_docs(doc_ids)
+        self.lexical.remove_docs(doc_ids)
+        promoted = []
+        chunk_ids = [m.get('chunk_id') for m in removed]
+        if self.dedup is not None:
+            self.dedup.remove(chunk_ids)
+        # Also with dedup off, since a loaded snapshot may hold chunks collapsed by an earlier run.
+        for cid in chunk_ids:
+            promoted += [self._duplicate_chunks.pop(r.get('chunk_id')) for r in self._duplicates.pop(cid, [])
+                         if r.get('doc_id') not in doc_ids]
+        if self._duplicate_chunks:
+            # In place: these lists are shared with the metadata of the surviving canonical chunks.
+            for refs in self._duplicates.values():
+                refs[:] = [r for r in refs if r.get('doc_id') not in doc_ids]
+            self._duplicate_chunks = {k: c for k, c in self._duplicate_chunks.items() if c.get('doc_id') not in doc_ids}
+        _log(f"Removed {len(removed)} chunks of {len(doc_ids)} documents in {time.time()-start:.2f}s. "
+             f"Total vectors now: {self.vs.index.ntotal}")
+        if promoted:
+            # The first survivor becomes canonical again and the rest collapse onto it; they were
+            # already counted as seen and collapsed, and handle_chunks_add counts them again.
+            if self.dedup is not None:
+                self.dedup_stats['seen'] -= len(promoted)
+                self.dedup_stats['collapsed'] -= len(promoted)
+            _log(f"Re-indexing {len(promoted)} near-duplicate chunks of other documents that were collapsed onto removed chunks")
+            self.handle_chunks_add(promoted)
+
+    def _is_identifier_query(self, query: str) -> bool:
+        """Short query containing an identifier-shaped token that is actually in the BM25 index."""
+        return 0 < len(query.split()) <= 3 and any(self.lexical.doc_freq(t) for t in identifier_terms(query))
+
+    def _dense_candidates(self, query: str, k: int):
+        start = time.time()
+        raw_results = self.vs.search(query, k=k)
+        _log(f"FAISS search returned {len(raw_results)} candidates in {time.time()-start:.2f}s")
+        return _as_candidates(raw_results)
+
+    def _lexical_candidates(self, query: str, k: int):
+        start = time.time()
+        raw_results = self.lexical.search(query, k=k)
+        _log(f"BM25 search returned {len(raw_results)} candidates in {time.time()-start:.3f}s")
+        return _as_candidates(raw_results)
+
+    def _fuse(self, *ranked_lists):
+        """Reciprocal-rank fusion; candidates are identified by chunk_id."""
+        fused = {}
+        for ranked in ranked_lists:
+            for rank, c in enumerate(ranked):
+                key = c['meta'].get('chunk_id') or c['text']
+                entry = fused.setdefault(key, dict(c, score=0.0))
+                entry['score'] += 1.0 / (RRF_K + rank + 1)
+        return sorted(fused.values(), key=lambda x: x['score'], reverse=True)
+
+    def _rerank(self, query: str, candidates):
         if self.reranker and len(candidates) > 0:
             _log(f"Reranking top {min(len(candidates), self.K_RERANK)} candidates with CrossEncoder")
             top_for_rerank = candidates[:self.K_RERANK]
@@ -71,23 +206,344 @@ class RetrievalAgent:
             for c, s in zip(top_for_rerank, scores):
                 c['rerank_score'] = float(s)
             top_for_rerank.sort(key=lambda x: x['rerank_score'], reverse=True)
-            final = top_for_rerank
+            return top_for_rerank
+        return candidates[:self.K_RERANK]
+
+    def _staged_rerank(self, query: str, candidates, deadline=None):
+        """
+        Rerank in stages of ADAPTIVE_STAGE_SIZE, stopping once a stage leaves the top
+        ADAPTIVE_STABLE_TOP unchanged, or when the next stage would overrun `deadline`.
+        Returns (candidates, exit_reason or None): the scored ones by rerank score, then any
+        left unscored by an early exit in their original order, up to K_RERANK in total.
+        """
+        if not self.reranker or not candidates:
+            return candidates[:self.K_RERANK], None
+        pool = candidates[:self.K_RERANK]
+        scored, prev_top, stage_s, exit_reason = [], None, 0.0, None
+        t0 = time.time()
+        for i in range(0, len(pool), ADAPTIVE_STAGE_SIZE):
+            if scored and deadline is not None and time.time() + stage_s > deadline:
+                exit_reason = 'budget_exit'
+                break
+            stage = pool[i:i + ADAPTIVE_STAGE_SIZE]
+            ts = time.time()
+            scores = self.reranker.predict([[query, c['text']] for c in stage])
+            stage_s = time.time() - ts
+            for c, s in zip(stage, scores):
+                c['rerank_score'] = float(s)
+            scored.extend(stage)
+            scored.sort(key=lambda x: x['rerank_score'], reverse=True)
+            top = [id(c) for c in scored[:ADAPTIVE_STABLE_TOP]]
+            if top == prev_top and i + ADAPTIVE_STAGE_SIZE < len(pool):
+                exit_reason = 'early_exit'
+                break
+            prev_top = top
+        _log(f"Staged rerank scored {len(scored)}/{len(pool)} pairs in {time.time()-t0:.2f}s (exit={exit_reason})")
+        # Stages are prefixes of the pool, so the unscored tail is everything after the scored count.
+        return scored + pool[len(scored):], exit_reason
+
+    def _rank(self, query: str, candidates, adaptive: bool, deadline=None, dense: bool = False):
+        if not adaptive:
+            return self._rerank(query, candidates)
+        stats = self.shortcut_stats
+        stats['queries'] += 1
+        if dense:
+            candidates, cut = _gap_cut(candidates)
+            if cut:
+                stats['gap_cut'] += 1
+                _log(f"Score-gap cut kept {len(candidates)} candidates")
+        final, exit_reason = self._staged_rerank(query, candidates, deadline)
+        if exit_reason:
+            stats[exit_reason] += 1
+        n = stats['queries']
+        _log("Adaptive shortcuts: " + ", ".join(f"{k}={stats[k]}/{n} ({stats[k]/n:.0%})"
+                                               for k in ('gap_cut', 'early_exit', 'budget_exit')))
+        return final
+
+    def retrieve(self, query: str, mode: str = None, adaptive: bool = None, latency_budget_ms: float = None):
+        """
+        Return (top_chunks, mode_used) for `query` using one of RETRIEVAL_MODES.
+        A latency budget always switches the query to adaptive (gap cut + staged rerank).
+        """
+        mode = mode or self.retrieval_mode
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode '{mode}', expected one of {RETRIEVAL_MODES}")
+        start = time.time()
+        if adaptive is None:
+            adaptive = self.adaptive
+        deadline = None
+        if latency_budget_ms is not None:
+            adaptive = True
+            deadline = start + latency_budget_ms / 1000.0
+        lexical = None
+        if mode == 'auto':
+            # Short queries naming an indexed identifier (part number, version, SKU) are served
+            # lexically; everything else, including "revenue in 2023", goes through hybrid fusion.
+            if self._is_identifier_query(query):
+                lexical = self._lexical_candidates(query, self.K_RETRIEVE)
+            mode = 'lexical' if lexical else 'hybrid'
+
+        if mode == 'lexical':
+            if lexical is None:
+                lexical = self._lexical_candidates(query, self.K_RERANK)
+            final = lexical[:self.K_RERANK]
+        elif mode == 'hybrid':
+            if lexical is None:
+                lexical = self._lexical_candidates(query, self.K_RETRIEVE)
+            fused = self._fuse(self._dense_candidates(query, self.K_RETRIEVE), lexical)
+            final = self._rank(query, fused, adaptive, deadline)
         else:
-            final = candidates[:self.K_RERANK]
-        top_chunks = [{'text': c['text'], 'meta': c['meta'], 'score': c.get('rerank_score', c.get('score'))} for c in final]
+            final = self._rank(query, self._dense_candidates(query, self.K_RETRIEVE), adaptive, deadline, dense=True)
+
+        elapsed = time.time() - start
+        stats = self.mode_stats.setdefault(mode, {'count': 0, 'total_s': 0.0})
+        stats['count'] += 1
+        stats['total_s'] += elapsed
+        if deadline is not None and time.time() > deadline:
+            _log(f"Latency budget of {latency_budget_ms:.0f}ms exceeded by {(time.time()-deadline)*1000:.0f}ms")
+        _log(f"mode={mode} latency={elapsed:.3f}s (avg {stats['total_s']/stats['count']:.3f}s over {stats['count']} queries)")
+        return _to_top_chunks(final), mode
+
+    def _rerank_many(self, candidates_by_query):
+        """Rerank each query's top K_RERANK candidates with one pooled, batched CrossEncoder call."""
+        pools = {q: c[:self.K_RERANK] for q, c in candidates_by_query.items()}
+        if not self.reranker:
+            return pools
+        pairs = [[q, c['text']] for q, pool in pools.items() for c in pool]
+        if not pairs:
+            return pools
+        t0 = time.time()
+        scores = iter(self.reranker.predict(pairs, batch_size=RERANK_BATCH_SIZE))
+        _log(f"Reranker scored {len(pairs)} pooled pairs for {len(pools)} queries in {time.time()-t0:.2f}s")
+        for pool in pools.values():
+            for c in pool:
+                c['rerank_score'] = float(next(scores))
+            pool.sort(key=lambda x: x['rerank_score'], reverse=True)
+        return pools
+
+    def retrieve_many(self, queries, mode: str = None):
+        """
+        Batch counterpart of retrieve(): one encode and one FAISS matrix search for all queries that
+        need the dense path, then one pooled rerank. Adaptive shortcuts are not applied.
+        Returns {query: top_chunks}; repeated queries are answered once.
+        """
+        mode = mode or self.retrieval_mode
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode '{mode}', expected one of {RETRIEVAL_MODES}")
+        start = time.time()
+        unique = list(dict.fromkeys(queries))
+        modes, lexical = {}, {}
+        for q in unique:
+            m = mode
+            if m == 'auto':
+                if self._is_identifier_query(q):
+                    lexical[q] = _as_candidates(self.lexical.search(q, k=self.K_RETRIEVE))
+                m = 'lexical' if lexical.get(q) else 'hybrid'
+            if m == 'hybrid' and q not in lexical:
+                lexical[q] = _as_candidates(self.lexical.search(q, k=self.K_RETRIEVE))
+            modes[q] = m
+
+        need_dense = [q for q in unique if modes[q] != 'lexical']
+        dense = {}
+        if need_dense:
+            t0 = time.time()
+            dense = dict(zip(need_dense, map(_as_candidates, self.vs.search_many(need_dense, k=self.K_RETRIEVE))))
+            _log(f"Batched FAISS search for {len(need_dense)} queries in {time.time()-t0:.2f}s")
+
+        finals, to_rerank = {}, {}
+        for q in unique:
+            if modes[q] == 'lexical':
+                finals[q] = (lexical.get(q) or _as_candidates(self.lexical.search(q, k=self.K_RERANK)))[:self.K_RERANK]
+            elif modes[q] == 'hybrid':
+                to_rerank[q] = self._fuse(dense[q], lexical[q])
+            else:
+                to_rerank[q] = dense[q]
+        finals.update(self._rerank_many(to_rerank))
+
+        elapsed = time.time() - start
+        _log(f"Batch retrieval of {len(queries)} queries ({len(unique)} unique) in {elapsed:.2f}s "
+             f"({len(unique) / max(elapsed, 1e-9):.1f} queries/s)")
+        return {q: _to_top_chunks(finals[q]) for q in unique}
+
+    def benchmark_batch(self, queries, mode: str = None):
+        """Compare throughput of retrieve() in a loop against retrieve_many() on the same queries."""
+        unique = list(dict.fromkeys(queries))
+        t0 = time.time()
+        for q in unique:
+            self.retrieve(q, mode=mode, adaptive=False)
+        loop_s = time.time() - t0
+        t0 = time.time()
+        self.retrieve_many(unique, mode=mode)
+        batch_s = time.time() - t0
+        report = {
+            'queries': len(unique),
+            'loop_queries_per_s': len(unique) / max(loop_s, 1e-9),
+            'batch_queries_per_s': len(unique) / max(batch_s, 1e-9),
+            'speedup': loop_s / max(batch_s, 1e-9),
+        }
+        _log(f"Batch vs loop over {len(unique)} queries: {report['batch_queries_per_s']:.1f} vs "
+             f"{report['loop_queries_per_s']:.1f} queries/s (x{report['speedup']:.2f})")
+        return report
+
+    def evaluate_modes(self, labeled, modes=RETRIEVAL_MODES):
+        """
+        Report mean latency and recall@K_RERANK per mode.
+        `labeled` is a list of (query, relevant_chunk_ids) pairs.
+        """
+        report = {}
+        for mode in modes:
+            total_s, recall_sum = 0.0, 0.0
+            for query, relevant in labeled:
+                relevant = set(relevant)
+                t0 = time.time()
+                top_chunks, _ = self.retrieve(query, mode=mode)
+                total_s += time.time() - t0
+                got = {c['meta'].get('chunk_id') for c in top_chunks}
+                recall_sum += len(got & relevant) / len(relevant) if relevant else 1.0
+            n = max(len(labeled), 1)
+            report[mode] = {'latency_s': total_s / n, 'recall': recall_sum / n}
+            _log(f"evaluate mode={mode}: latency={report[mode]['latency_s']*1000:.1f}ms recall@{self.K_RERANK}={report[mode]['recall']:.3f}")
+        return report
+
+    def do_retrieval(self, msg: Dict[str,Any]):
+        query = msg['payload']['query']
+        trace = msg.get('trace_id')
+        mode = msg['payload'].get('mode')
+        _log(f"RETRIEVAL_REQUEST trace={trace} q='{query[:120]}' — searching top {self.K_RETRIEVE}")
+        top_chunks, mode_used = self.retrieve(query, mode=mode, adaptive=msg['payload'].get('adaptive'),
+                                              latency_budget_ms=msg['payload'].get('latency_budget_ms'))
         _log(f"Returning {len(top_chunks)} top chunks to MCP Broker (trace={trace})")
         resp = {
             'type': 'RETRIEVAL_COMPLETE',
             'sender': 'RetrievalAgent',
             'receiver': 'MCPBroker',
             'trace_id': trace,
-            'payload': {'retrieved_context': top_chunks, 'query': query}
+            'payload': {'retrieved_context': top_chunks, 'query': query, 'mode': mode_used}
         }
         self.out_q.put(resp)
 
+    def do_retrieval_batch(self, msg: Dict[str,Any]):
+        queries = msg['payload'].get('queries', [])
+        trace = msg.get('trace_id')
+        _log(f"RETRIEVAL_BATCH_REQUEST trace={trace} with {len(queries)} queries")
+        results = self.retrieve_many(queries, mode=msg['payload'].get('mode'))
+        self.out_q.put({
+            'type': 'RETRIEVAL_BATCH_COMPLETE',
+            'sender': 'RetrievalAgent',
+            'receiver': 'MCPBroker',
+            'trace_id': trace,
+            'payload': {'results': results},
+        })
+
+    def save_snapshot(self, path: str = None):
+        """
+        Persist FAISS vectors, metadata, BM25 and dedup state to `path` (default index_dir).
+        Written to a sibling temp directory first and swapped in, so a crash never leaves a torn snapshot.
+        """
+        path = (path or self.index_dir or '').rstrip('/\\')
+        if not path:
+            raise ValueError("No snapshot directory configured")
+        start = time.time()
+        tmp, old = path + '.tmp', path + '.old'
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        self.vs.save_index(tmp)
+        # One pickle so the 'duplicates' lists stay shared between FAISS and BM25 metadata.
+        state = {
+            'metadatas': self.vs.metadatas,
+            'lexical': self.lexical,
+            'dedup': self.dedup,
+            'dedup_stats': self.dedup_stats,
+            'duplicates': self._duplicates,
+            'duplicate_chunks': self._duplicate_chunks,
+            'index_seq': self.index_seq,
+        }
+        with open(os.path.join(tmp, 'state.pkl'), 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        shutil.rmtree(old, ignore_errors=True)
+        if os.path.exists(path):
+            os.replace(path, old)
+        os.replace(tmp, path)
+        shutil.rmtree(old, ignore_errors=True)
+        self._last_snapshot = time.time()
+        _log(f"Saved snapshot of {len(self.vs.metadatas)} chunks to {path} in {time.time()-start:.2f}s")
+        return path
+
+    def load_snapshot(self, path: str):
+        """Load a snapshot written by save_snapshot; returns False if there is none."""
+        path = path.rstrip('/\\')
+        if not os.path.exists(os.path.join(path, 'state.pkl')) and os.path.exists(os.path.join(path + '.old', 'state.pkl')):
+            path = path + '.old'  # crashed between the two renames in save_snapshot
+        if not os.path.exists(os.path.join(path, 'state.pkl')):
+            _log(f"No snapshot at {path}; starting with an empty index")
+            return False
+        start = time.time()
+        with open(os.path.join(path, 'state.pkl'), 'rb') as f:
+            state = pickle.load(f)
+        self.vs.load_index(path, state['metadatas'])
+        self.lexical = state['lexical']
+        self._duplicates = state['duplicates']
+        self._duplicate_chunks = state['duplicate_chunks']
+        self.dedup_stats = state['dedup_stats']
+        self.index_seq = state.get('index_seq')
+        snap_dedup = state['dedup']
+        if self.dedup is not None and snap_dedup is not None and snap_dedup.threshold == self.dedup.threshold:
+            self.dedup = snap_dedup
+        elif self.dedup is not None:
+            _log("Snapshot dedup state does not match dedup_threshold; near-duplicates of existing chunks won't be collapsed")
+        _log(f"Loaded snapshot of {len(self.vs.metadatas)} chunks from {path} in {time.time()-start:.2f}s")
+        return True
+
+    def handle_snapshot(self, msg: Dict[str,Any]):
+        path = self.save_snapshot(msg.get('payload', {}).get('path'))
+        self.out_q.put({
+            'type': 'SNAPSHOT_COMPLETE',
+            'sender': 'RetrievalAgent',
+            'trace_id': msg.get('trace_id'),
+            'payload': {'path': path, 'num_chunks': len(self.vs.metadatas), 'index_seq': self.index_seq},
+        })
+
     def run_once(self, msg):
         t = msg.get('type')
         if t == 'CHUNKS_ADD':
-            self.handle_chunks_add(msg['payload'].get('chunks', []))
+            # Recorded before handling so a message that keeps failing is not replayed after a restart.
+            self.index_seq = msg.get('index_seq', self.index_seq)
+            chunks = msg['payload'].get('chunks', [])
+            self.handle_chunks_add(chunks)
+            if msg['payload'].get('ack'):
+                self.out_q.put({
+                    'type': 'CHUNKS_INDEXED',
+                    'sender': 'RetrievalAgent',
+                    'receiver': 'IngestionAgent',
+                    'trace_id': msg.get('trace_id'),
+                    'payload': {'ack': msg['payload']['ack'], 'num_chunks': len(chunks)},
+                })
+            if (self.index_dir and self.snapshot_interval_s is not None
+                    and time.time() - self._last_snapshot >= self.snapshot_interval_s):
+                self.handle_snapshot({'type': 'SNAPSHOT_INDEX', 'payload': {}})
+        elif t == 'CHUNKS_REMOVE':
+            self.index_seq = msg.get('index_seq', self.index_seq)
+            self.handle_chunks_remove(msg['payload'].get('doc_ids', []))
         elif t == 'RETRIEVAL_REQUEST':
-            self.do_retrieval(msg)
\ No newline at end of file
+            self.do_retrieval(msg)
+        elif t == 'RETRIEVAL_BATCH_REQUEST':
+            self.do_retrieval_batch(msg)
+        elif t == 'SNAPSHOT_INDEX':
+            self.handle_snapshot(msg)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmark batched vs per-query retrieval on a saved index")
+    parser.add_argument("index_dir", help="snapshot directory (e.g. rag_index/snapshot from bulk_ingest.py)")
+    parser.add_argument("queries_file", help="text file with one query per line")
+    parser.add_argument("--mode", default="dense", choices=RETRIEVAL_MODES)
+    parser.add_argument("--embedding-model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--embedding-backend", default="torch")
+    args = parser.parse_args()
+
+    agent = RetrievalAgent(None, None, embedding_model=args.embedding_model, embedding_backend=args.embedding_backend,
+                           retrieval_mode=args.mode, index_dir=args.index_dir)
+    with open(args.queries_file, encoding="utf-8") as f:
+        queries = [line.strip() for line in f if line.strip()]
+    print(agent.benchmark_batch(queries))
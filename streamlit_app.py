@@ -7,8 +7,24 @@ import html as html_lib
 from mcp_agent import start_mcp 
 
 EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+# One of "torch", "int8", "onnx", "onnx-int8"; non-torch backends are autotuned for the host at startup.
+EMBEDDING_BACKEND = "torch"
 K_RETRIEVE = 50
 K_RERANK = 10
+# One of "dense", "lexical", "hybrid", "auto" (lexical fast path for short queries naming an indexed
+# part number/version/SKU, hybrid otherwise). Compare recall per mode with RetrievalAgent.evaluate_modes
+# on your own labeled queries before switching to "auto".
+RETRIEVAL_MODE = "hybrid"
+# Cut candidates at FAISS score gaps and rerank in stages with early exit. Off by default, as in
+# MCPBroker/start_mcp; a RETRIEVAL_LATENCY_BUDGET_MS turns it on for each query regardless.
+ADAPTIVE_RETRIEVAL = False
+# Per-query retrieval latency budget in milliseconds (None disables it).
+RETRIEVAL_LATENCY_BUDGET_MS = None
+# Collapse chunks whose estimated Jaccard similarity is at least this onto one vector, e.g. 0.85.
+# Off by default, as in MCPBroker/start_mcp.
+DEDUP_THRESHOLD = None
+# Snapshot directory to load the index from (e.g. "rag_index/snapshot" written by bulk_ingest.py).
+INDEX_DIR = None
 OLLAMA_MODEL = "llama3.2:1b"
 
 def _log_ui(msg: str):
@@ -69,8 +85,13 @@ def init_session_state():
             _log_ui("Auto-starting MCP broker and agents...")
             broker, queues = start_mcp(
                 embedding_model=EMBEDDING_MODEL,
+                embedding_backend=EMBEDDING_BACKEND,
                 K_RETRIEVE=K_RETRIEVE,
                 K_RERANK=K_RERANK,
+                retrieval_mode=RETRIEVAL_MODE,
+                adaptive=ADAPTIVE_RETRIEVAL,
+                dedup_threshold=DEDUP_THRESHOLD,
+                index_dir=INDEX_DIR,
                 llm_model=OLLAMA_MODEL,
             )
             st.session_state.mcp_broker = broker
@@ -90,7 +111,7 @@ def append_assistant(text: str, sources=None):
 # ---------- UI ----------
 def render_upload_ui(mcp_broker):
     st.header("Upload Files")
-    uploaded = st.file_uploader("Choose files", accept_multiple_files=True, type=["pdf", "pptx", "docx", "csv", "txt", "md"])
+    uploaded = st.file_uploader("Choose files", accept_multiple_files=True, type=["pdf", "pptx", "docx", "csv", "tsv", "xlsx", "txt", "md"])
     if st.button("Ingest files"):
         if not uploaded:
             st.warning("Select files first.")
@@ -102,10 +123,18 @@ def render_upload_ui(mcp_broker):
             ts = datetime.now().isoformat()
             _log_ui(f"Ingest pressed at {ts} — sending {len(files_payload)} files to MCP Broker")
             with st.spinner("Parsing uploaded files (indexing runs in background)..."):
-                resp = mcp_broker.upload_files(files_payload)
+                try:
+                    resp = mcp_broker.upload_files(files_payload)
+                except (RuntimeError, TimeoutError) as e:
+                    _log_ui(f"Upload failed: {e}")
+                    st.error(f"Ingestion failed: {e}")
+                    return
                 results = resp.get("payload", {}).get("results", [])
                 total_chunks = sum(r.get("num_chunks", 0) for r in results)
-                st.success(f"Parsed {total_chunks} chunks from {len(results)} files. Indexing may continue in background.")
+                failed = [r for r in results if r.get("error")]
+                st.success(f"Parsed {total_chunks} chunks from {len(results) - len(failed)} files. Indexing may continue in background.")
+                for r in failed:
+                    st.warning(f"Could not read {r.get('doc_name')}: {r['error']}")
                 
 
 def render_chat_history_only():
@@ -122,7 +151,11 @@ def handle_chat_input(mcp_broker):
         append_user(user_prompt)
         _log_ui(f"User prompt sent to MCP Broker: {user_prompt[:200]}")
         with st.spinner("Retrieving and generating answer..."):
-            resp = mcp_broker.ask_query(user_prompt)
+            try:
+                resp = mcp_broker.ask_query(user_prompt, latency_budget_ms=RETRIEVAL_LATENCY_BUDGET_MS)
+            except (RuntimeError, TimeoutError) as e:
+                _log_ui(f"Query failed: {e}")
+                resp = {"payload": {"answer": f"[Query failed: {e}]"}}
             answer = resp.get("payload", {}).get("answer", "")
             retrieved = resp.get("payload", {}).get("retrieved_context", [])
             if answer is None or not str(answer).strip():
@@ -0,0 +1,56 @@
+import hashlib
+import os
+import sys
+
+import pytest
+
+# The modules live flat at the repo root.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+STUB_DIM = 32
+
+
+class StubEncoder:
+    """Bag-of-words hashed into STUB_DIM buckets: deterministic and model-free."""
+    name = "stub"
+    dim = STUB_DIM
+    batch_size = 32
+
+    def set_threads(self, n):
+        pass
+
+    def encode(self, texts):
+        import numpy as np
+        out = np.zeros((len(texts), STUB_DIM), dtype='float32')
+        for row, t in enumerate(texts):
+            for w in t.lower().split():
+                out[row, int(hashlib.md5(w.encode()).hexdigest(), 16) % STUB_DIM] += 1
+        return out / np.maximum(np.linalg.norm(out, axis=1, keepdims=True), 1e-9)
+
+
+class StubReranker:
+    """Word overlap, tie-broken by length so scores are distinct."""
+
+    def __init__(self, model_name=None):
+        pass
+
+    def predict(self, pairs, batch_size=32):
+        import numpy as np
+        return np.array([len(set(q.lower().split()) & set(t.lower().split())) + 1.0 / (1 + len(t))
+                         for q, t in pairs])
+
+
+@pytest.fixture
+def make_retrieval_agent(monkeypatch):
+    """Build a RetrievalAgent on StubEncoder/StubReranker; skipped without numpy, faiss or sentence_transformers."""
+    pytest.importorskip("numpy")
+    pytest.importorskip("faiss")
+    pytest.importorskip("sentence_transformers")
+    import retrieval_agent
+    import vector_store
+    monkeypatch.setattr(vector_store, "load_encoder", lambda *args, **kwargs: StubEncoder())
+    monkeypatch.setattr(retrieval_agent, "CrossEncoder", StubReranker)
+
+    def make(**kwargs):
+        return retrieval_agent.RetrievalAgent(None, None, **kwargs)
+    return make
@@ -0,0 +1,83 @@
+import os
+
+import pytest
+
+from bulk_ingest import BulkIngester, Checkpoint
+
+
+class FakeBroker:
+    """Records index updates; files whose content starts with 'corrupt' fail to parse."""
+
+    def __init__(self):
+        self.uploaded, self.removed = [], []
+        self.snapshots = 0
+        self.lost_index_updates = 0
+
+    def remove_docs(self, doc_ids):
+        self.removed.extend(doc_ids)
+
+    def upload_files(self, files, timeout=None):
+        results = []
+        for rel, path in files:
+            self.uploaded.append(rel)
+            with open(path) as f:
+                text = f.read()
+            if text.startswith("corrupt"):
+                results.append({"doc_name": rel, "num_chunks": 0, "error": "PDFSyntaxError: no /Root object"})
+            else:
+                results.append({"doc_id": f"id-{rel}-{len(self.uploaded)}", "doc_name": rel, "num_chunks": 1})
+        return {"type": "INGESTION_COMPLETE", "payload": {"results": results, "chunks": []}}
+
+    def snapshot_index(self, timeout=None):
+        self.snapshots += 1
+
+
+@pytest.fixture
+def tree(tmp_path):
+    root = tmp_path / "docs"
+    root.mkdir()
+    (root / "good.txt").write_text("fine")
+    (root / "bad.txt").write_text("corrupt bytes")
+    return root
+
+
+def _run(root, checkpoint_path, broker=None):
+    broker = broker or FakeBroker()
+    stats = BulkIngester(broker, str(root), Checkpoint(str(checkpoint_path)), batch_files=1).run()
+    return broker, stats
+
+
+def test_failed_file_does_not_abort_the_run(tree, tmp_path):
+    broker, stats = _run(tree, tmp_path / "ckpt.json")
+    assert stats['files'] == 2 and stats['failed'] == 1
+    entries = Checkpoint(str(tmp_path / "ckpt.json")).entries
+    assert "error" in entries["bad.txt"] and "doc_id" not in entries["bad.txt"]
+    assert entries["good.txt"]["doc_id"]
+
+
+def test_failed_file_is_skipped_until_it_changes(tree, tmp_path):
+    _run(tree, tmp_path / "ckpt.json")
+    broker, stats = _run(tree, tmp_path / "ckpt.json")
+    assert broker.uploaded == [] and stats['unchanged'] == 2
+
+    (tree / "bad.txt").write_text("repaired")
+    os.utime(tree / "bad.txt", (1, 1))
+    broker, stats = _run(tree, tmp_path / "ckpt.json")
+    assert broker.uploaded == ["bad.txt"] and stats['failed'] == 0
+    assert broker.removed == []
+    assert "error" not in Checkpoint(str(tmp_path / "ckpt.json")).entries["bad.txt"]
+
+
+def test_lost_index_updates_block_the_checkpoint(tree, tmp_path):
+    broker = FakeBroker()
+    upload = broker.upload_files
+
+    def upload_then_lose(files, timeout=None):
+        broker.lost_index_updates += 1
+        return upload(files, timeout)
+    broker.upload_files = upload_then_lose
+
+    with pytest.raises(RuntimeError, match="lost 2 index updates"):
+        _run(tree, tmp_path / "ckpt.json", broker)
+    assert broker.snapshots == 0
+    assert not os.path.exists(tmp_path / "ckpt.json")
@@ -0,0 +1,63 @@
+import random
+
+import pytest
+
+pytest.importorskip("faiss")
+pytest.importorskip("sentence_transformers")
+
+_rng = random.Random(0)
+REPORT = [_rng.choice([f"w{i}" for i in range(500)]) for _ in range(200)]
+
+
+def _chunk(doc_id, words):
+    return {'doc_id': doc_id, 'chunk_id': f"{doc_id}__0", 'doc_name': f"{doc_id}.txt",
+            'text': " ".join(words), 'meta': {'source': f"{doc_id}.txt", 'chunk_index': 0}}
+
+
+def _edited(n):
+    words = list(REPORT)
+    words[100 + n] = f"edit{n}"
+    return words
+
+
+@pytest.fixture
+def agent(make_retrieval_agent):
+    agent = make_retrieval_agent(K_RETRIEVE=5, K_RERANK=5, dedup_threshold=0.85)
+    agent.handle_chunks_add([_chunk("v1", REPORT), _chunk("v2", _edited(2)), _chunk("v3", _edited(3))])
+    assert agent.vs.index.ntotal == 1
+    return agent
+
+
+def _chunk_ids(agent, query):
+    return [c['meta']['chunk_id'] for c in agent.retrieve(query, mode='dense')[0]]
+
+
+def test_removing_canonical_chunk_promotes_its_duplicates(agent):
+    agent.handle_chunks_remove(["v1"])
+    assert agent.vs.index.ntotal == 1
+    assert _chunk_ids(agent, " ".join(REPORT)) == ["v2__0"]
+    assert agent.lexical.search("edit2", k=5)[0]['meta']['chunk_id'] == "v2__0"
+    assert [r['chunk_id'] for r in agent.vs.metadatas[max(agent.vs.metadatas)]['duplicates']] == ["v3__0"]
+    assert agent.dedup_stats == {'seen': 3, 'collapsed': 1}
+
+
+def test_duplicates_of_removed_documents_are_dropped(agent):
+    agent.handle_chunks_remove(["v1", "v2"])
+    assert _chunk_ids(agent, " ".join(REPORT)) == ["v3__0"]
+    agent.handle_chunks_remove(["v3"])
+    assert agent.vs.index.ntotal == 0
+    assert not agent._duplicates and not agent._duplicate_chunks
+
+
+def test_removing_a_duplicate_keeps_the_canonical_chunk(agent):
+    agent.handle_chunks_remove(["v2"])
+    assert _chunk_ids(agent, " ".join(REPORT)) == ["v1__0"]
+    assert [r['chunk_id'] for r in agent.vs.metadatas[0]['duplicates']] == ["v3__0"]
+    assert set(agent._duplicate_chunks) == {"v3__0"}
+
+
+def test_snapshot_round_trip_keeps_collapsed_chunks(agent, make_retrieval_agent, tmp_path):
+    agent.save_snapshot(str(tmp_path / "snap"))
+    loaded = make_retrieval_agent(K_RETRIEVE=5, K_RERANK=5, dedup_threshold=0.85, index_dir=str(tmp_path / "snap"))
+    loaded.handle_chunks_remove(["v1"])
+    assert _chunk_ids(loaded, " ".join(REPORT)) == ["v2__0"]
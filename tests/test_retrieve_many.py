@@ -0,0 +1,57 @@
+import pytest
+
+pytest.importorskip("faiss")
+pytest.importorskip("sentence_transformers")
+
+from retrieval_agent import RETRIEVAL_MODES
+
+DOCS = [
+    "Quarterly revenue grew 12% in 2023 driven by enterprise renewals.",
+    "Customer churn in Q3 was concentrated in the self-serve tier.",
+    "Replace filter cartridge 7731-AX-09 every six months.",
+    "The 7731-AX-10 cartridge fits the older housing only.",
+    "Firmware v2.4.1 fixes the pump controller watchdog reset.",
+    "Enterprise renewals were signed mostly in the fourth quarter.",
+    "Support tickets about the pump controller doubled after the update.",
+    "The self-serve tier has the highest churn of all plans.",
+    "Revenue recognition follows the subscription term.",
+    "Housing dimensions are listed in the installation guide.",
+]
+
+QUERIES = [
+    "revenue in 2023",
+    "Q3 churn",
+    "7731-AX-09",
+    "pump controller firmware v2.4.1",
+    "which cartridge fits the older housing",
+    "revenue in 2023",
+]
+
+
+@pytest.fixture
+def agent(make_retrieval_agent):
+    agent = make_retrieval_agent(K_RETRIEVE=6, K_RERANK=4)
+    agent.handle_chunks_add([
+        {'doc_id': f"doc{i // 2}", 'chunk_id': f"doc{i // 2}-{i % 2}", 'doc_name': f"doc{i // 2}.txt",
+         'text': text, 'meta': {'source': f"doc{i // 2}.txt", 'chunk_index': i % 2}}
+        for i, text in enumerate(DOCS)
+    ])
+    return agent
+
+
+def _ids(top_chunks):
+    return [(c['meta']['chunk_id'], pytest.approx(c['score'])) for c in top_chunks]
+
+
+@pytest.mark.parametrize("mode", RETRIEVAL_MODES)
+def test_retrieve_many_matches_retrieve(agent, mode):
+    batch = agent.retrieve_many(QUERIES, mode=mode)
+    assert list(batch) == list(dict.fromkeys(QUERIES))
+    for q in batch:
+        single, _ = agent.retrieve(q, mode=mode, adaptive=False)
+        assert _ids(batch[q]) == _ids(single), q
+
+
+def test_auto_mode_routes_identifier_queries_lexically(agent):
+    assert agent.retrieve("7731-AX-09", mode='auto')[1] == 'lexical'
+    assert agent.retrieve("revenue in 2023", mode='auto')[1] == 'hybrid'
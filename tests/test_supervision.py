@@ -0,0 +1,208 @@
+import json
+import os
+import signal
+import time
+
+import pytest
+
+import agent_processes as ap
+import mcp_agent
+from mcp_agent import MCPBroker
+
+# Broker supervision with lightweight stand-in agents (no models): the retrieval stand-in keeps a
+# list of chunk ids, snapshots it as JSON and reports index_seq exactly like RetrievalAgent.
+
+
+class FakeRetrievalAgent:
+    def __init__(self, out_q, index_dir):
+        self.out_q = out_q
+        self.index_dir = index_dir
+        self.chunk_ids = []
+        self.index_seq = None
+        path = os.path.join(index_dir, 'snapshot.json') if index_dir else None
+        if path and os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            self.chunk_ids, self.index_seq = state['chunk_ids'], state['index_seq']
+
+    def run_once(self, msg):
+        t = msg.get('type')
+        if t == 'CHUNKS_ADD':
+            if any(c['chunk_id'] == 'poison' for c in msg['payload']['chunks']):
+                os._exit(1)
+            self.index_seq = msg.get('index_seq', self.index_seq)
+            self.chunk_ids.extend(c['chunk_id'] for c in msg['payload']['chunks'])
+        elif t == 'SNAPSHOT_INDEX':
+            path = msg['payload'].get('path') or self.index_dir
+            os.makedirs(path, exist_ok=True)
+            with open(os.path.join(path, 'snapshot.json'), 'w') as f:
+                json.dump({'chunk_ids': self.chunk_ids, 'index_seq': self.index_seq}, f)
+            self.out_q.put({'type': 'SNAPSHOT_COMPLETE', 'sender': 'RetrievalAgent', 'trace_id': msg.get('trace_id'),
+                            'payload': {'path': path, 'num_chunks': len(self.chunk_ids), 'index_seq': self.index_seq}})
+        elif t == 'RETRIEVAL_BATCH_REQUEST':
+            self.out_q.put({'type': 'RETRIEVAL_BATCH_COMPLETE', 'sender': 'RetrievalAgent', 'trace_id': msg.get('trace_id'),
+                            'payload': {'results': {q: list(self.chunk_ids) for q in msg['payload']['queries']}}})
+
+
+class FakeIngestionAgent:
+    def __init__(self, out_q):
+        self.out_q = out_q
+
+    def run_once(self, msg):
+        chunks = [{'chunk_id': name, 'text': text} for name, text in msg['payload']['files']]
+        self.out_q.put({'type': 'INGESTION_COMPLETE', 'sender': 'IngestionAgent', 'trace_id': msg.get('trace_id'),
+                        'payload': {'results': [], 'chunks': chunks}})
+
+
+class IdleAgent:
+    def run_once(self, msg):
+        pass
+
+
+def run_fake_retrieval(in_q, out_q, index_dir, busy=None, index_seq=None):
+    ap._reset_signals()
+    agent = FakeRetrievalAgent(out_q, index_dir)
+    out_q.put({'type': 'AGENT_READY', 'sender': 'RetrievalAgent', 'payload': {'index_seq': agent.index_seq}})
+    ap._serve(agent, in_q.get, out_q, 'RetrievalAgent', busy, index_seq)
+
+
+def run_fake_ingestion(in_q, out_q, busy=None):
+    ap._reset_signals()
+    out_q.put({'type': 'AGENT_READY', 'sender': 'IngestionAgent', 'payload': {}})
+    ap._serve(FakeIngestionAgent(out_q), in_q.get, out_q, 'IngestionAgent', busy)
+
+
+def run_fake_llm(in_q, out_q, busy=None):
+    ap._reset_signals()
+    out_q.put({'type': 'AGENT_READY', 'sender': 'LLMResponseAgent', 'payload': {}})
+    ap._serve(IdleAgent(), in_q.get, out_q, 'LLMResponseAgent', busy)
+
+
+class FakeBroker(MCPBroker):
+    def _agent_target(self, name):
+        if name == "IngestionAgent":
+            return run_fake_ingestion, ()
+        if name == "RetrievalAgent":
+            return run_fake_retrieval, (self.index_dir,)
+        return run_fake_llm, ()
+
+
+@pytest.fixture
+def make_broker(monkeypatch):
+    monkeypatch.setattr(mcp_agent, "SUPERVISE_INTERVAL", 0.1)
+    handlers = (signal.getsignal(signal.SIGINT), signal.getsignal(signal.SIGTERM))
+    brokers = []
+
+    def make(**kwargs):
+        b = FakeBroker(**kwargs)
+        b.start()
+        brokers.append(b)
+        return b
+
+    yield make
+    for b in brokers:
+        b.stop()
+    signal.signal(signal.SIGINT, handlers[0])
+    signal.signal(signal.SIGTERM, handlers[1])
+
+
+def _wait_until(cond, timeout=20.0):
+    deadline = time.time() + timeout
+    while not cond():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.05)
+
+
+def _upload(b, *names):
+    for n in names:
+        b.upload_files([(n, f"text of {n}")], timeout=10)
+
+
+def _indexed(b):
+    return sorted(b.retrieve_many(["q"], timeout=10)["q"])
+
+
+def _kill_retrieval_and_wait(b):
+    restarts = len(b.restart_stats)
+    b._proc_by_name["RetrievalAgent"].kill()
+    _wait_until(lambda: len(b.restart_stats) > restarts)
+
+
+def test_restart_replays_updates_not_in_snapshot(make_broker, tmp_path):
+    b = make_broker(index_dir=str(tmp_path / "snap"))
+    _upload(b, "a", "b", "c")
+    b.snapshot_index(timeout=10)
+    _upload(b, "d", "e")
+    _kill_retrieval_and_wait(b)
+    assert _indexed(b) == ["a", "b", "c", "d", "e"]
+
+
+def test_restart_after_reloading_snapshot_from_earlier_run(make_broker, tmp_path):
+    index_dir = str(tmp_path / "snap")
+    first = make_broker(index_dir=index_dir)
+    _upload(first, *[f"old{i}" for i in range(5)])
+    first.snapshot_index(timeout=10)
+    first.stop()
+
+    # A new broker session starts counting from 1 while the snapshot says 5 from the old session.
+    b = make_broker(index_dir=index_dir)
+    _upload(b, "new0", "new1", "new2")
+    _kill_retrieval_and_wait(b)
+    assert _indexed(b) == sorted([f"old{i}" for i in range(5)] + ["new0", "new1", "new2"])
+
+
+def test_snapshot_elsewhere_does_not_trim_replay_log(make_broker, tmp_path):
+    b = make_broker(index_dir=str(tmp_path / "snap"))
+    _upload(b, "a", "b")
+    b.snapshot_index(path=str(tmp_path / "copy"), timeout=10)
+    _kill_retrieval_and_wait(b)
+    assert _indexed(b) == ["a", "b"]
+
+
+def test_calls_fail_fast_while_agent_is_down(make_broker, tmp_path):
+    b = make_broker(index_dir=str(tmp_path / "snap"))
+    _upload(b, "a")
+    restart = b._restart
+    b._restart = lambda name: (time.sleep(1.0), restart(name))
+    b._proc_by_name["RetrievalAgent"].kill()
+    _wait_until(lambda: "RetrievalAgent" in b._down)
+
+    start = time.time()
+    with pytest.raises(RuntimeError, match="restarting"):
+        b.snapshot_index()
+    with pytest.raises(RuntimeError, match="restarting"):
+        b.retrieve_many(["q"])
+    assert time.time() - start < 1.0
+
+    # Ingestion is still up; its chunks are logged and replayed once the agent is ready.
+    _upload(b, "b")
+    _wait_until(lambda: b.restart_stats)
+    assert _indexed(b) == ["a", "b"]
+
+
+def test_restart_counts_updates_the_log_no_longer_holds(make_broker, tmp_path):
+    b = make_broker(index_dir=str(tmp_path / "snap"), replay_limit=2)
+    _upload(b, "a", "b", "c", "d")
+    _kill_retrieval_and_wait(b)
+    assert _indexed(b) == ["c", "d"]
+    assert b.lost_index_updates == 2
+
+
+def test_update_that_keeps_crashing_the_agent_is_quarantined(make_broker, tmp_path):
+    b = make_broker(index_dir=str(tmp_path / "snap"))
+    _upload(b, "a", "poison", "b")
+    _wait_until(lambda: b.lost_index_updates == 1)
+    _wait_until(lambda: "RetrievalAgent" not in b._down)
+    assert len(b.restart_stats) == mcp_agent.POISON_CRASH_LIMIT
+    assert _indexed(b) == ["a", "b"]
+    _upload(b, "c")
+    assert _indexed(b) == ["a", "b", "c"]
+
+
+def test_ready_before_spawn_is_recorded_still_clears_down():
+    b = MCPBroker()
+    b._down.add("LLMResponseAgent")
+    b._restart_pending["LLMResponseAgent"] = {'detected': time.time()}
+    b._on_agent_ready("LLMResponseAgent", {'type': 'AGENT_READY', 'payload': {}})
+    assert "LLMResponseAgent" not in b._down
+    assert len(b.restart_stats) == 1
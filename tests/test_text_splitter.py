@@ -0,0 +1,42 @@
+import random
+
+import pytest
+
+from text_splitter import RecursiveTextSplitter
+
+text_splitters = pytest.importorskip("langchain_text_splitters")
+
+_WORDS = ["lorem", "ipsum", "dolor", "sit", "amet", "x" * 40, "y" * 130, "a", "", "\t"]
+_SEPS = [" ", " ", " ", "\n", "\n\n", "\n\n\n", "  ", " \n"]
+
+
+def _random_text(rng):
+    parts = []
+    for _ in range(rng.randint(0, 400)):
+        parts.append(rng.choice(_WORDS))
+        parts.append(rng.choice(_SEPS))
+    return "".join(parts)
+
+
+def test_matches_langchain_on_random_inputs():
+    rng = random.Random(1234)
+    for _ in range(3000):
+        chunk_size = rng.randint(5, 300)
+        chunk_overlap = rng.randint(0, chunk_size)
+        text = _random_text(rng)
+        ours = RecursiveTextSplitter(chunk_size, chunk_overlap)
+        theirs = text_splitters.RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        assert ours.split_text(text) == theirs.split_text(text), (chunk_size, chunk_overlap, text)
+
+
+def test_offsets_slice_the_source_text():
+    text = "alpha beta\n\ngamma delta epsilon\nzeta " * 50
+    splitter = RecursiveTextSplitter(chunk_size=60, chunk_overlap=10)
+    spans = splitter.split_offsets(text)
+    assert [text[s:e] for s, e in spans] == splitter.split_text(text)
+    assert all(0 <= s < e <= len(text) for s, e in spans)
+
+
+def test_overlap_larger_than_chunk_size_is_rejected():
+    with pytest.raises(ValueError):
+        RecursiveTextSplitter(chunk_size=10, chunk_overlap=20)
@@ -0,0 +1,16 @@
+import io
+
+import pytest
+
+for _mod in ("pdfplumber", "pptx", "docx"):
+    pytest.importorskip(_mod)
+
+from utils import iter_row_chunks, iter_tables
+
+
+def test_csv_cells_over_default_field_limit():
+    big = "x" * 200_000
+    data = f"id,body\n1,{big}\n2,short\n".encode()
+    chunks = [c for _, rows in iter_tables("export.csv", io.BytesIO(data)) for c in iter_row_chunks(rows, max_chars=800)]
+    assert [(first, last) for _, first, last in chunks] == [(1, 1), (2, 2)]
+    assert big in chunks[0][0]
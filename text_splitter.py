@@ -0,0 +1,146 @@
+from typing import List, Tuple
+
+DEFAULT_SEPARATORS = ["\n\n", "\n", " ", ""]
+
+
+class RecursiveTextSplitter:
+    """
+    Drop-in for langchain's RecursiveCharacterTextSplitter (keep_separator=True, strip_whitespace=True)
+    that works on (start, end) offsets into the source text and only slices when emitting chunks.
+    """
+
+    def __init__(self, chunk_size: int = 800, chunk_overlap: int = 100, separators: List[str] = None):
+        if chunk_overlap > chunk_size:
+            raise ValueError(f"chunk_overlap ({chunk_overlap}) is larger than chunk_size ({chunk_size})")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.separators = list(separators or DEFAULT_SEPARATORS)
+
+    def split_offsets(self, text: str) -> List[Tuple[int, int]]:
+        """Return (start, end) character offsets of each chunk in `text`."""
+        spans = []
+        self._split(text, 0, len(text), self.separators, spans)
+        return spans
+
+    def split_text(self, text: str) -> List[str]:
+        return [text[s:e] for s, e in self.split_offsets(text)]
+
+    def _split(self, text, start, end, separators, out):
+        separator = separators[-1]
+        new_separators = []
+        for i, sep in enumerate(separators):
+            if sep == "":
+                separator = sep
+                break
+            if text.find(sep, start, end) != -1:
+                separator = sep
+                new_separators = separators[i + 1:]
+                break
+
+        good = []
+        for s, e in _pieces(text, start, end, separator):
+            if e - s < self.chunk_size:
+                good.append((s, e))
+            else:
+                if good:
+                    self._merge(text, good, out)
+                    good = []
+                if not new_separators:
+                    out.append((s, e))
+                else:
+                    self._split(text, s, e, new_separators, out)
+        if good:
+            self._merge(text, good, out)
+
+    def _merge(self, text, pieces, out):
+        # Pieces are contiguous, so a window of them is the span [first.start, last.end).
+        window = []
+        first = 0
+        total = 0
+        for s, e in pieces:
+            n = e - s
+            if total + n > self.chunk_size and len(window) > first:
+                _emit(text, window[first][0], window[-1][1], out)
+                while total > self.chunk_overlap or (total + n > self.chunk_size and total > 0):
+                    total -= window[first][1] - window[first][0]
+                    first += 1
+            window.append((s, e))
+            total += n
+        if len(window) > first:
+            _emit(text, window[first][0], window[-1][1], out)
+
+
+def _pieces(text, start, end, separator):
+    """Split [start, end) before each occurrence of `separator`, dropping empty pieces."""
+    if separator == "":
+        return [(i, i + 1) for i in range(start, end)]
+    pieces = []
+    step = len(separator)
+    prev = start
+    pos = text.find(separator, start, end)
+    while pos != -1:
+        if pos > prev:
+            pieces.append((prev, pos))
+        prev = pos
+        pos = text.find(separator, pos + step, end)
+    if end > prev:
+        pieces.append((prev, end))
+    return pieces
+
+def _emit(text, start, end, out):
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    if end > start:
+        out.append((start, end))
+
+
+if __name__ == "__main__":
+    import argparse
+    import random
+    import time
+
+    parser = argparse.ArgumentParser(description="Benchmark RecursiveTextSplitter against langchain's splitter")
+    parser.add_argument("files", nargs="*", help="text files to split (defaults to a synthetic corpus)")
+    parser.add_argument("--chunk-size", type=int, default=800)
+    parser.add_argument("--chunk-overlap", type=int, default=100)
+    args = parser.parse_args()
+
+    if args.files:
+        docs = [open(p, encoding="utf-8", errors="ignore").read() for p in args.files]
+    else:
+        rng = random.Random(0)
+        vocab = ["lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "x" * 900, "adipiscing", "elit"]
+        docs = []
+        for _ in range(5):
+            paras = []
+            for _ in range(2000):
+                lines = [" ".join(rng.choices(vocab, weights=[20] * 6 + [1] + [20] * 2, k=rng.randint(3, 60)))
+                         for _ in range(rng.randint(1, 6))]
+                paras.append("\n".join(lines))
+            docs.append("\n\n".join(paras))
+    total_chars = sum(len(d) for d in docs)
+
+    native = RecursiveTextSplitter(args.chunk_size, args.chunk_overlap)
+    t0 = time.perf_counter()
+    native_out = [native.split_text(d) for d in docs]
+    t_native = time.perf_counter() - t0
+    print(f"native:    {t_native:.3f}s ({total_chars / t_native / 1e6:.1f} MB/s), {sum(map(len, native_out))} chunks")
+
+    try:
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+    except ImportError:
+        try:
+            from langchain.text_splitter import RecursiveCharacterTextSplitter
+        except ImportError:
+            RecursiveCharacterTextSplitter = None
+    if RecursiveCharacterTextSplitter is None:
+        print("langchain not installed; skipping parity check")
+    else:
+        lc = RecursiveCharacterTextSplitter(chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap)
+        t0 = time.perf_counter()
+        lc_out = [lc.split_text(d) for d in docs]
+        t_lc = time.perf_counter() - t0
+        print(f"langchain: {t_lc:.3f}s ({total_chars / t_lc / 1e6:.1f} MB/s), {sum(map(len, lc_out))} chunks")
+        print(f"speedup x{t_lc / t_native:.2f}, identical output: {native_out == lc_out}")
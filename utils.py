@@ -1,22 +1,30 @@
-import io, uuid
-import pandas as pd
+import io, mmap, uuid, csv, sys
 import pdfplumber
 from pptx import Presentation
 from docx import Document
 
-def read_pdf(file_stream: io.BytesIO) -> str:
+# csv.reader rejects fields over 131072 chars by default; exports with large text or JSON cells
+# are normal, and a long row becomes its own chunk anyway. (C long limit on Windows.)
+csv.field_size_limit(min(sys.maxsize, 2**31 - 1))
+
+def _no_progress():
+    pass
+
+def read_pdf(file_stream: io.BytesIO, progress=_no_progress) -> str:
     text = []
     with pdfplumber.open(file_stream) as pdf:
         for page in pdf.pages:
+            progress()
             page_text = page.extract_text()
             if page_text:
                 text.append(page_text)
     return "\n".join(text)
 
-def read_pptx(file_stream: io.BytesIO) -> str:
+def read_pptx(file_stream: io.BytesIO, progress=_no_progress) -> str:
     prs = Presentation(file_stream)
     slides_text = []
     for i, slide in enumerate(prs.slides):
+        progress()
         parts = []
         for shape in slide.shapes:
             if hasattr(shape, "text") and shape.text:
@@ -32,23 +40,129 @@ def read_docx(file_stream: io.BytesIO) -> str:
 def read_txt(file_stream: io.BytesIO) -> str:
     return file_stream.read().decode(errors="ignore")
 
-def read_csv(file_stream: io.BytesIO) -> str:
-    df = pd.read_csv(file_stream)
-    return df.to_csv(index=False)
+class MmapReader(io.RawIOBase):
+    """
+    Read-only, seekable stream over an open file through a memory map, so parsers read pages
+    from the OS page cache instead of a private copy of the whole file. The file may be closed
+    once the reader is created; close the reader to release the map.
+    """
+
+    def __init__(self, f):
+        super().__init__()
+        self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def read(self, size=-1):
+        return self._mm.read(None if size is None or size < 0 else size)
+
+    def readinto(self, b):
+        data = self._mm.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def seek(self, pos, whence=io.SEEK_SET):
+        self._mm.seek(pos, whence)
+        return self._mm.tell()
+
+    def tell(self):
+        return self._mm.tell()
+
+    def close(self):
+        if not self.closed:
+            self._mm.close()
+        super().close()
+
+TABULAR_EXTS = ("csv", "tsv", "xlsx")
+
+def is_tabular(filename: str) -> bool:
+    return filename.split(".")[-1].lower() in TABULAR_EXTS
+
+def iter_tables(filename: str, file_stream: io.BytesIO):
+    """
+    Stream a CSV/TSV/XLSX file as (table_name, rows) pairs, where rows is an iterator over
+    lists of cell strings starting with the header row. Never materializes the whole table.
+    """
+    ext = filename.split(".")[-1].lower()
+    if ext == "xlsx":
+        try:
+            from openpyxl import load_workbook
+        except ImportError as e:
+            raise RuntimeError("Reading .xlsx files requires the 'openpyxl' package") from e
+        wb = load_workbook(file_stream, read_only=True, data_only=True)
+        try:
+            for ws in wb.worksheets:
+                rows = (["" if v is None else str(v) for v in r] for r in ws.iter_rows(values_only=True))
+                yield ws.title, rows
+        finally:
+            wb.close()
+    else:
+        text = io.TextIOWrapper(file_stream, encoding="utf-8-sig", errors="ignore", newline="")
+        try:
+            yield None, csv.reader(text, delimiter="\t" if ext == "tsv" else ",")
+        finally:
+            text.detach()
+
+def iter_row_chunks(rows, max_chars: int = 800):
+    """
+    Group whole rows into chunks of about max_chars, each starting with the header line.
+    Yields (text, first_row, last_row) with 1-based data row numbers; a row longer than
+    max_chars becomes its own chunk rather than being cut.
+    """
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+
+    def to_line(row):
+        buf.seek(0)
+        buf.truncate()
+        writer.writerow(row)
+        return buf.getvalue()
+
+    rows = iter(rows)
+    header = next(rows, None)
+    if header is None:
+        return
+    header_line = to_line(header)
+    lines, size, first, last = [], len(header_line), 1, 0
+    for row_no, row in enumerate(rows, start=1):
+        if not any(cell.strip() for cell in row):
+            continue
+        line = to_line(row)
+        if lines and size + len(line) > max_chars:
+            yield header_line + "".join(lines), first, last
+            lines, size = [], len(header_line)
+        if not lines:
+            first = row_no
+        lines.append(line)
+        size += len(line)
+        last = row_no
+    if lines:
+        yield header_line + "".join(lines), first, last
+
+def new_doc_id(filename: str) -> str:
+    return f"{uuid.uuid4()}_{filename}"
 
-def infer_and_read(filename: str, file_stream: io.BytesIO):
+def infer_and_read(filename: str, file_stream: io.BytesIO, progress=_no_progress):
+    """
+    Parse a non-tabular file into (doc_id, text). `progress` is called per PDF page and PPTX
+    slide, so a caller supervised for hangs can show that a large document is still moving.
+    """
     ext = filename.split(".")[-1].lower()
-    doc_id = f"{uuid.uuid4()}_{filename}"
+    doc_id = new_doc_id(filename)
     if ext == "pdf":
-        text = read_pdf(file_stream)
+        text = read_pdf(file_stream, progress)
     elif ext == "pptx":
-        text = read_pptx(file_stream)
+        text = read_pptx(file_stream, progress)
     elif ext == "docx":
         text = read_docx(file_stream)
     elif ext in ("txt","md"):
         text = read_txt(file_stream)
-    elif ext == "csv":
-        text = read_csv(file_stream)
+    elif is_tabular(filename):
+        raise ValueError(f"{filename} is tabular; stream it with iter_tables() instead")
     else:
         text = read_txt(file_stream)
     return doc_id, text
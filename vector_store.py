@@ -1,27 +1,338 @@
 from sentence_transformers import SentenceTransformer
 import numpy as np
 import faiss
+import json
+import os
+import re
+import socket
+import time
+from datetime import datetime
 from threading import Lock
 
-class SimpleFAISS:
-    def __init__(self, model_name='all-MiniLM-L6-v2'):
-        self.model = SentenceTransformer(model_name)
+ENCODER_BACKENDS = ('torch', 'int8', 'onnx', 'onnx-int8')
+
+# Small, varied probe set used to check that an optimized backend still produces
+# vectors compatible with the ones already in the index, and to autotune it.
+_PROBE_TEXTS = [
+    "What is the total revenue reported for the third quarter?",
+    "slide 4:\nRoadmap and key milestones for the next release",
+    "Part number 7731-AX-09 replaced by 7731-AX-10 in revision C.",
+    "The agent forwards retrieved chunks to the LLM response agent.",
+    "id,name,price\n17,bolt M6,0.12\n18,nut M6,0.05",
+    "Employees must complete the security training before accessing production systems.",
+    "Reranking with a cross-encoder improves precision of the top results.",
+    "Le rapport annuel présente les résultats financiers consolidés.",
+    "Q: How do I reset my password? A: Use the self-service portal.",
+    "FAISS builds an index over dense vectors for similarity search.",
+    "Disclaimer: this document is provided for informational purposes only.",
+    "Temperature readings exceeded the threshold on three consecutive days.",
+    "Install dependencies with pip and start the Ollama server locally.",
+    "The contract terminates automatically unless renewed in writing.",
+    "Quarterly churn decreased from 4.1% to 3.6% after the pricing change.",
+    "short",
+]
+
+def _log(msg):
+    print(f"[{datetime.now().isoformat()}] [VectorStore] {msg}")
+
+def _cache_dir():
+    cache_dir = os.environ.get("RAG_ONNX_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "agentic_rag", "onnx"))
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+def _default_onnx_path(model_name, quantized=False):
+    safe = re.sub(r'[^A-Za-z0-9_.-]+', '_', model_name)
+    return os.path.join(_cache_dir(), f"{safe}{'-int8' if quantized else ''}.onnx")
+
+def _tmp_path(path):
+    # Same directory as `path` so os.replace is an atomic rename; keeps the extension for exporters.
+    root, ext = os.path.splitext(path)
+    return f"{root}.tmp{os.getpid()}{ext}"
+
+def _tuning_key(model_name, backend):
+    return f"{socket.gethostname()}|{os.cpu_count()}|{model_name}|{backend}"
+
+def _load_tuning(model_name, backend):
+    path = os.path.join(_cache_dir(), "tuning.json")
+    try:
+        with open(path) as f:
+            return json.load(f).get(_tuning_key(model_name, backend))
+    except (OSError, ValueError):
+        return None
+
+def _save_tuning(model_name, backend, entry):
+    path = os.path.join(_cache_dir(), "tuning.json")
+    try:
+        with open(path) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+    cache[_tuning_key(model_name, backend)] = entry
+    tmp = _tmp_path(path)
+    with open(tmp, 'w') as f:
+        json.dump(cache, f, indent=1)
+    os.replace(tmp, path)
+
+def _export_onnx(model: SentenceTransformer, path: str):
+    """Export the full SentenceTransformer (transformer + pooling + normalize) to ONNX."""
+    import torch
+
+    dummy = model.tokenizer(["export probe sentence"], padding=True, return_tensors='pt')
+    names = [n for n in ('input_ids', 'attention_mask', 'token_type_ids') if n in dummy]
+
+    class _SentenceEmbedding(torch.nn.Module):
+        def __init__(self, st):
+            super().__init__()
+            self.st = st
+
+        def forward(self, *args):
+            return self.st(dict(zip(names, args)))['sentence_embedding']
+
+    wrapper = _SentenceEmbedding(model).eval()
+    dynamic_axes = {n: {0: 'batch', 1: 'seq'} for n in names}
+    dynamic_axes['sentence_embedding'] = {0: 'batch'}
+    _log(f"Exporting ONNX model to {path}")
+    # Export next to the final path and rename, so an interrupted export never leaves a partial model.
+    tmp = _tmp_path(path)
+    try:
+        with torch.no_grad():
+            torch.onnx.export(wrapper, tuple(dummy[n] for n in names), tmp,
+                              input_names=names, output_names=['sentence_embedding'],
+                              dynamic_axes=dynamic_axes, opset_version=14)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+class TorchEncoder:
+    """Stock PyTorch SentenceTransformer encoder; the baseline all other backends are checked against."""
+    name = 'torch'
+
+    def __init__(self, model_name='all-MiniLM-L6-v2', model=None):
+        self.model = model if model is not None else SentenceTransformer(model_name)
         self.dim = self.model.get_sentence_embedding_dimension()
-        self.index = faiss.IndexFlatL2(self.dim)
-        self.metadatas = []
+        self.batch_size = 32
+        self.threads = None
+
+    def set_threads(self, n: int):
+        import torch
+        torch.set_num_threads(n)
+        self.threads = n
+
+    def encode(self, texts):
+        vecs = self.model.encode(list(texts), batch_size=self.batch_size, convert_to_numpy=True, show_progress_bar=False)
+        return np.asarray(vecs, dtype='float32')
+
+
+class QuantizedTorchEncoder(TorchEncoder):
+    """PyTorch encoder with Linear layers dynamically quantized to int8."""
+    name = 'int8'
+
+    def __init__(self, model_name='all-MiniLM-L6-v2', model=None):
+        import torch
+        base = model if model is not None else SentenceTransformer(model_name)
+        quantized = torch.quantization.quantize_dynamic(base, {torch.nn.Linear}, dtype=torch.qint8)
+        super().__init__(model_name, model=quantized)
+
+
+class OnnxEncoder:
+    """onnxruntime encoder over an exported (optionally int8-quantized) SentenceTransformer graph."""
+    name = 'onnx'
+
+    def __init__(self, model_name='all-MiniLM-L6-v2', model=None, onnx_path=None, quantize=False):
+        try:
+            import onnxruntime
+        except ImportError as e:
+            raise RuntimeError("The 'onnx' encoder backends require the 'onnxruntime' package") from e
+        self._ort = onnxruntime
+        base = model if model is not None else SentenceTransformer(model_name)
+        self.tokenizer = base.tokenizer
+        self.max_seq_length = base.max_seq_length
+        self.dim = base.get_sentence_embedding_dimension()
+
+        fp32_path = _default_onnx_path(model_name)
+        if not os.path.exists(fp32_path):
+            _export_onnx(base, fp32_path)
+        if quantize:
+            self.name = 'onnx-int8'
+            self.onnx_path = onnx_path or _default_onnx_path(model_name, quantized=True)
+            if not os.path.exists(self.onnx_path):
+                from onnxruntime.quantization import quantize_dynamic, QuantType
+                _log(f"Quantizing ONNX model to int8 at {self.onnx_path}")
+                tmp = _tmp_path(self.onnx_path)
+                try:
+                    quantize_dynamic(fp32_path, tmp, weight_type=QuantType.QInt8)
+                    os.replace(tmp, self.onnx_path)
+                finally:
+                    if os.path.exists(tmp):
+                        os.remove(tmp)
+        else:
+            self.onnx_path = onnx_path or fp32_path
+
+        self.batch_size = 32
+        self.set_threads(os.cpu_count() or 1)
+
+    def set_threads(self, n: int):
+        opts = self._ort.SessionOptions()
+        opts.intra_op_num_threads = n
+        opts.graph_optimization_level = self._ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = self._ort.InferenceSession(self.onnx_path, opts, providers=['CPUExecutionProvider'])
+        self._input_names = {i.name for i in self.session.get_inputs()}
+        self.threads = n
+
+    def encode(self, texts):
+        texts = list(texts)
+        out = []
+        for i in range(0, len(texts), self.batch_size):
+            enc = self.tokenizer(texts[i:i + self.batch_size], padding=True, truncation=True,
+                                 max_length=self.max_seq_length, return_tensors='np')
+            feeds = {k: np.asarray(v, dtype='int64') for k, v in enc.items() if k in self._input_names}
+            out.append(self.session.run(None, feeds)[0])
+        if not out:
+            return np.zeros((0, self.dim), dtype='float32')
+        return np.vstack(out).astype('float32')
+
+
+def _throughput(encoder, texts, repeat=1):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        encoder.encode(texts)
+    elapsed = time.perf_counter() - start
+    return (len(texts) * repeat) / elapsed if elapsed > 0 else float('inf')
+
+def compare_encoders(baseline, candidate, texts=None, repeat=3):
+    """Report throughput of both encoders and row-wise cosine agreement of candidate vs baseline."""
+    texts = list(texts or _PROBE_TEXTS)
+    a = baseline.encode(texts)
+    b = candidate.encode(texts)
+    num = np.sum(a * b, axis=1)
+    den = np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1)
+    cos = num / np.maximum(den, 1e-12)
+    base_tps = _throughput(baseline, texts, repeat)
+    cand_tps = _throughput(candidate, texts, repeat)
+    return {
+        'baseline': baseline.name,
+        'candidate': candidate.name,
+        'baseline_texts_per_s': base_tps,
+        'candidate_texts_per_s': cand_tps,
+        'speedup': cand_tps / base_tps if base_tps else float('nan'),
+        'mean_cosine': float(np.mean(cos)),
+        'min_cosine': float(np.min(cos)),
+    }
+
+def autotune_encoder(encoder, texts=None, batch_sizes=(8, 16, 32, 64, 128), thread_counts=None, n_texts=256):
+    """Pick the thread count, then the batch size, that maximize encode throughput on this host."""
+    base = list(texts or _PROBE_TEXTS)
+    sample = (base * (n_texts // len(base) + 1))[:n_texts]
+    cpus = os.cpu_count() or 1
+    if thread_counts is None:
+        thread_counts = sorted({1, max(1, cpus // 2), cpus})
+
+    encoder.encode(sample[:encoder.batch_size])  # warm-up
+    best_threads, best_tps = None, -1.0
+    for n in thread_counts:
+        encoder.set_threads(n)
+        tps = _throughput(encoder, sample)
+        _log(f"autotune [{encoder.name}] threads={n} batch={encoder.batch_size}: {tps:.1f} texts/s")
+        if tps > best_tps:
+            best_threads, best_tps = n, tps
+    encoder.set_threads(best_threads)
+
+    best_batch = encoder.batch_size
+    for bs in batch_sizes:
+        encoder.batch_size = bs
+        tps = _throughput(encoder, sample)
+        _log(f"autotune [{encoder.name}] threads={best_threads} batch={bs}: {tps:.1f} texts/s")
+        if tps > best_tps:
+            best_batch, best_tps = bs, tps
+    encoder.batch_size = best_batch
+    _log(f"autotune [{encoder.name}] selected threads={best_threads} batch={best_batch} ({best_tps:.1f} texts/s)")
+    return {'threads': best_threads, 'batch_size': best_batch, 'texts_per_s': best_tps}
+
+def load_encoder(model_name='all-MiniLM-L6-v2', backend='torch', autotune=None, min_agreement=0.99, use_cache=True):
+    """
+    Build the encoder for `backend`. Optimized backends are derived from the same weights as the
+    PyTorch model and are only used if their vectors agree with it (min cosine >= min_agreement),
+    so they stay compatible with vectors already in the index; otherwise we fall back to PyTorch.
+    The agreement verdict and tuned threads/batch size are cached per host and model in
+    <RAG_ONNX_CACHE>/tuning.json, so restarts skip both; delete that file to re-check and re-tune.
+    """
+    if backend not in ENCODER_BACKENDS:
+        raise ValueError(f"Unknown embedding backend '{backend}', expected one of {ENCODER_BACKENDS}")
+    if autotune is None:
+        autotune = backend != 'torch'
+    tuned = _load_tuning(model_name, backend) if use_cache else None
+
+    baseline = TorchEncoder(model_name)
+    encoder = baseline
+    load_failed = False
+    if backend != 'torch' and (tuned is None or tuned['encoder'] != 'torch'):
+        try:
+            if backend == 'int8':
+                import copy
+                candidate = QuantizedTorchEncoder(model_name, model=copy.deepcopy(baseline.model))
+            else:
+                candidate = OnnxEncoder(model_name, model=baseline.model, quantize=(backend == 'onnx-int8'))
+            if tuned is not None:
+                encoder = candidate
+            else:
+                report = compare_encoders(baseline, candidate)
+                _log(f"Backend '{candidate.name}' vs torch: {report['candidate_texts_per_s']:.1f} vs "
+                     f"{report['baseline_texts_per_s']:.1f} texts/s (x{report['speedup']:.2f}), "
+                     f"cosine mean={report['mean_cosine']:.4f} min={report['min_cosine']:.4f}")
+                if report['min_cosine'] >= min_agreement:
+                    encoder = candidate
+                else:
+                    _log(f"Backend '{candidate.name}' below agreement threshold {min_agreement}; using torch")
+        except Exception as e:
+            load_failed = True
+            _log(f"Failed to load embedding backend '{backend}': {e}; using torch")
+
+    if tuned is not None and tuned['encoder'] == encoder.name:
+        encoder.set_threads(tuned['threads'])
+        encoder.batch_size = tuned['batch_size']
+        _log(f"Using cached tuning for '{encoder.name}': threads={tuned['threads']} batch={tuned['batch_size']}")
+    elif autotune:
+        result = autotune_encoder(encoder)
+        # Don't cache a fallback caused by a load error (e.g. onnxruntime missing); retry next start.
+        if use_cache and not load_failed:
+            _save_tuning(model_name, backend, dict(result, encoder=encoder.name))
+    return encoder
+
+class SimpleFAISS:
+    def __init__(self, model_name='all-MiniLM-L6-v2', backend='torch', autotune=None):
+        self.model_name = model_name
+        self.encoder = load_encoder(model_name, backend=backend, autotune=autotune)
+        self.dim = self.encoder.dim
+        # Vectors carry explicit ids so chunks of a re-ingested document can be removed.
+        self.index = faiss.IndexIDMap(faiss.IndexFlatL2(self.dim))
+        self.metadatas = {}
+        self._next_id = 0
         self.lock = Lock()
 
     def add(self, texts, metas):
-        vecs = self.model.encode(texts, convert_to_numpy=True, show_progress_bar=False)
+        vecs = self.encoder.encode(texts)
         with self.lock:
-            self.index.add(np.array(vecs).astype('float32'))
-            for m, t in zip(metas, texts):
+            ids = np.arange(self._next_id, self._next_id + len(texts), dtype='int64')
+            self.index.add_with_ids(np.array(vecs).astype('float32'), ids)
+            self._next_id += len(texts)
+            for i, m, t in zip(ids, metas, texts):
                 mm = m.copy()
                 mm['text'] = t
-                self.metadatas.append(mm)
+                self.metadatas[int(i)] = mm
+
+    def remove_docs(self, doc_ids):
+        """Remove every vector whose metadata doc_id is in `doc_ids`; returns the removed metadata."""
+        doc_ids = set(doc_ids)
+        with self.lock:
+            ids = [i for i, m in self.metadatas.items() if m.get('doc_id') in doc_ids]
+            if ids:
+                self.index.remove_ids(np.array(ids, dtype='int64'))
+            return [self.metadatas.pop(i) for i in ids]
 
     def search(self, query: str, k: int = 10):
-        qvec = self.model.encode([query], convert_to_numpy=True)
+        qvec = self.encoder.encode([query])
         qvec = np.array(qvec).astype('float32')
         with self.lock:
             if self.index.ntotal == 0:
@@ -29,6 +340,67 @@ class SimpleFAISS:
             D, I = self.index.search(qvec, k)
             results = []
             for idx, dist in zip(I[0], D[0]):
-                if 0 <= idx < len(self.metadatas):
+                if idx in self.metadatas:
                     results.append({'score': float(dist), 'meta': self.metadatas[idx]})
             return results
+
+    def search_many(self, queries, k: int = 10):
+        """Encode all queries in one batch and run a single FAISS search; returns one result list per query."""
+        queries = list(queries)
+        if not queries:
+            return []
+        qvecs = np.array(self.encoder.encode(queries)).astype('float32')
+        with self.lock:
+            if self.index.ntotal == 0:
+                return [[] for _ in queries]
+            D, I = self.index.search(qvecs, k)
+            return [
+                [{'score': float(dist), 'meta': self.metadatas[idx]}
+                 for idx, dist in zip(I[row], D[row]) if idx in self.metadatas]
+                for row in range(len(queries))
+            ]
+
+    def save_index(self, dirpath: str):
+        """Write the FAISS index and the model it was built with; metadata is persisted by the caller."""
+        with self.lock:
+            faiss.write_index(self.index, os.path.join(dirpath, 'faiss.index'))
+            with open(os.path.join(dirpath, 'faiss.json'), 'w') as f:
+                json.dump({'model_name': self.model_name, 'dim': self.dim, 'ntotal': self.index.ntotal}, f)
+
+    def load_index(self, dirpath: str, metadatas):
+        with open(os.path.join(dirpath, 'faiss.json')) as f:
+            info = json.load(f)
+        if info['model_name'] != self.model_name or info['dim'] != self.dim:
+            raise ValueError(f"Index in {dirpath} was built with {info['model_name']} (dim={info['dim']}), "
+                             f"not {self.model_name} (dim={self.dim})")
+        index = faiss.read_index(os.path.join(dirpath, 'faiss.index'))
+        if index.ntotal != len(metadatas):
+            raise ValueError(f"Index in {dirpath} has {index.ntotal} vectors but {len(metadatas)} metadata entries")
+        if not isinstance(metadatas, dict):
+            raise ValueError(f"Index in {dirpath} has {type(metadatas).__name__} metadata; expected a dict keyed by vector id")
+        with self.lock:
+            self.index = index
+            self.metadatas = metadatas
+            self._next_id = max(metadatas) + 1 if metadatas else 0
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmark embedding backends against the PyTorch baseline")
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--backends", nargs="+", default=['int8', 'onnx', 'onnx-int8'])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    baseline = TorchEncoder(args.model)
+    texts = _PROBE_TEXTS * 16
+    for backend in args.backends:
+        if backend == 'int8':
+            import copy
+            candidate = QuantizedTorchEncoder(args.model, model=copy.deepcopy(baseline.model))
+        else:
+            candidate = OnnxEncoder(args.model, model=baseline.model, quantize=(backend == 'onnx-int8'))
+        tuned = autotune_encoder(candidate)
+        r = compare_encoders(baseline, candidate, texts, repeat=args.repeat)
+        print(f"{backend:10s} threads={tuned['threads']:<3d} batch={tuned['batch_size']:<4d} "
+              f"torch={r['baseline_texts_per_s']:.1f}/s {backend}={r['candidate_texts_per_s']:.1f}/s "
+              f"speedup=x{r['speedup']:.2f} cos_mean={r['mean_cosine']:.5f} cos_min={r['min_cosine']:.5f}")